@@ -0,0 +1,133 @@
+# detection_engine.py
+import abc
+import collections
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from ptgaze.utils import (check_path_all, create_dummy_camera, download_gaze_model, expanduser_all,
+                          load_packaged_config)
+
+logger = logging.getLogger(__name__)
+
+# The cameras of the last upload sizes kept by each engine
+MAX_CAMERAS = 8
+
+
+class Detections(NamedTuple):
+    faces: Optional[List]  # ptgaze faces, None with the OpenCV fallback
+    face_locations: List[Dict[str, int]]
+
+
+def create_gaze_estimator_config(mode: str = 'MPIIFaceGaze', device: Optional[str] = None):
+    """Create a GazeEstimator configuration from the packaged ptgaze configs"""
+    config = load_packaged_config(mode.lower())
+    config.face_detector.mode = 'mediapipe'
+    # The uploads are unrelated images, not the frames of a video
+    config.face_detector.mediapipe_static_image_mode = True
+    config.face_detector.track_faces = False
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    config.device = device
+    expanduser_all(config)
+
+    download_gaze_model(config)
+    check_path_all(config)
+
+    OmegaConf.set_readonly(config, True)
+    return config
+
+
+def face_bbox_to_location(bbox):
+    """Convert a ptgaze bbox ([[x0, y0], [x1, y1]]) to the response format"""
+    (x0, y0), (x1, y1) = np.round(bbox).astype(int)
+    return {'x': int(x0), 'y': int(y0), 'w': int(x1 - x0), 'h': int(y1 - y0)}
+
+
+class DetectionEngine(abc.ABC):
+    """Finds the faces of a decoded frame, recording per-stage timings"""
+    name = None
+
+    @abc.abstractmethod
+    def detect(self, image: np.ndarray, timings: Dict[str, float], run_inference: bool = True) -> Detections:
+        """Detect the faces of image, adding the stage durations to timings"""
+
+
+class PtgazeEngine(DetectionEngine):
+    """ptgaze landmark detection, head pose normalization and gaze estimation"""
+    name = 'ptgaze_advanced'
+
+    def __init__(self, config, load_model: bool = True):
+        from ptgaze.gaze_estimator import GazeEstimator
+
+        # Without the model, the faces can only be detected and normalized
+        self.gaze_estimator = GazeEstimator(config, load_model=load_model)
+        # The calibration of the students' cameras is unknown, so the camera
+        # is derived from the size of each upload as in the ptgaze demo
+        self._cameras = collections.OrderedDict()
+
+    def _set_camera(self, width: int, height: int) -> None:
+        size = (width, height)
+        camera = self._cameras.get(size)
+        if camera is None:
+            camera = create_dummy_camera(width, height)
+            self._cameras[size] = camera
+            if len(self._cameras) > MAX_CAMERAS:
+                self._cameras.popitem(last=False)
+        else:
+            self._cameras.move_to_end(size)
+        if camera is not self.gaze_estimator.camera:
+            self.gaze_estimator.set_camera(camera)
+
+    def detect(self, image, timings, run_inference=True):
+        self._set_camera(image.shape[1], image.shape[0])
+        # The estimator times its own stages: detection, head_pose,
+        # normalization and, with the forward pass, preprocessing and inference
+        with self.gaze_estimator.timer.frame() as durations:
+            faces = self.gaze_estimator.detect_faces(image)
+            self.gaze_estimator.normalize_faces(image, faces)
+            # Without run_inference the caller batches the forward pass itself
+            if run_inference:
+                self.gaze_estimator.predict_gaze(faces)
+        del durations['total']
+        timings.update({stage: duration * 1000 for stage, duration in durations.items()})
+
+        return Detections(faces, [face_bbox_to_location(face.bbox) for face in faces])
+
+
+class CascadeEngine(DetectionEngine):
+    """Basic face detection using an OpenCV Haar cascade (fallback)"""
+    name = 'opencv_basic'
+
+    def __init__(self):
+        # Parsing the cascade XML is expensive, so it's done once per worker
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def detect(self, image, timings, run_inference=True):
+        start = time.perf_counter()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        timings['detection'] = _elapsed_ms(start)
+        return Detections(None, [{'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)} for (x, y, w, h) in faces])
+
+
+def create_detection_engine(config=None, load_model: bool = True) -> DetectionEngine:
+    """Use ptgaze when a configuration is given and loads, the cascade otherwise
+
+    load_model=False skips the gaze model, when the forward pass runs elsewhere.
+    """
+    if config is not None:
+        try:
+            return PtgazeEngine(config, load_model)
+        except Exception as e:
+            logger.error(f"ptgaze detection engine failed, falling back to OpenCV: {e}")
+    return CascadeEngine()
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
@@ -0,0 +1,103 @@
+# frame_executor.py
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a stage is submitted while the executor queue is full"""
+
+
+class FrameExecutor:
+    """Runs CPU-heavy frame stages off the asyncio event loop
+
+    kind is either "thread" or "process". Both call the initializer once per
+    worker, so each worker can own its detectors and GazeEstimator. At most
+    max_workers stages run at once and at most max_queue_depth more wait
+    for a worker; anything beyond that is rejected with ExecutorSaturated
+    instead of queueing up unbounded latency.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: Optional[int] = None,
+                 max_queue_depth: Optional[int] = None, initializer=None, initargs=()):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_queue_depth is None:
+            max_queue_depth = 2 * max_workers
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._initializer = initializer
+        self._initargs = initargs
+        self._executor = self._create_executor()
+
+        # Only touched from the event loop thread, so no lock is needed
+        self._in_flight = 0
+
+    def _create_executor(self):
+        if self.kind == "thread":
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="frame-worker",
+                                      initializer=self._initializer, initargs=self._initargs)
+        # Forking a process that already initialized torch/OpenMP can
+        # deadlock the children, so the workers are spawned fresh
+        return ProcessPoolExecutor(max_workers=self.max_workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=self._initializer, initargs=self._initargs)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of submitted stages still waiting for a free worker"""
+        return max(0, self._in_flight - self.max_workers)
+
+    @property
+    def saturated(self) -> bool:
+        return self._in_flight >= self.max_workers + self.max_queue_depth
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on a worker, or raise ExecutorSaturated when full"""
+        if self.saturated:
+            raise ExecutorSaturated(f"{self._in_flight} frames already in flight")
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BrokenExecutor:
+            # A worker crashed or its initializer raised, which breaks the
+            # executor for good, so it's replaced by a new one. The frames
+            # that were running on it have already failed.
+            logger.error("The frame executor is broken, restarting its workers")
+            self._executor.shutdown(wait=False)
+            self._executor = self._create_executor()
+            future = self._executor.submit(fn, *args)
+        self._in_flight += 1
+        # A cancelled caller (e.g. a disconnected client) doesn't stop a frame
+        # that already runs on a worker, so the frame is counted until the
+        # worker is done with it, not until the caller stops waiting
+        future.add_done_callback(lambda _: self._call_in_loop(loop, self._finished))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self):
+        self._in_flight -= 1
+
+    @staticmethod
+    def _call_in_loop(loop, fn):
+        # Done callbacks run on the worker thread or the executor's
+        # management thread, but _in_flight is only touched from the loop
+        try:
+            loop.call_soon_threadsafe(fn)
+        except RuntimeError:
+            # The loop is already closed at shutdown
+            pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
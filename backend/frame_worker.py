@@ -0,0 +1,66 @@
+# frame_worker.py
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from detection_engine import DetectionEngine, create_detection_engine
+
+logger = logging.getLogger(__name__)
+
+# Every executor worker (thread or process) owns its detection engine,
+# since the ptgaze landmark estimators are not safe to share between
+# threads. The engine is loaded once and reused for every frame.
+_worker = threading.local()
+
+
+class FrameResult(NamedTuple):
+    faces: Optional[List]  # ptgaze faces, None with the OpenCV fallback
+    face_locations: List[Dict[str, int]]
+    detection_method: str
+    timings: Dict[str, float]  # Milliseconds per stage
+
+
+def init_worker(gaze_estimator_config=None, load_model: bool = True):
+    """Executor initializer: load the detection engine owned by this worker
+
+    load_model=False skips the gaze model when the inference scheduler runs
+    every forward pass, so the workers don't hold unused model weights.
+    """
+    try:
+        _worker.engine = create_detection_engine(gaze_estimator_config, load_model)
+    except Exception as e:
+        # An initializer that raises breaks the whole executor, so the
+        # engine is created again when the worker gets its first frame
+        logger.error(f"Frame worker failed to load its detection engine: {e}")
+        _worker.engine = None
+        return
+    logger.info(f"Frame worker uses the {_worker.engine.name} detection engine")
+
+
+def get_engine() -> DetectionEngine:
+    if getattr(_worker, 'engine', None) is None:
+        _worker.engine = create_detection_engine()
+    return _worker.engine
+
+
+def process_frame(contents: bytes, run_inference: bool = True) -> Optional[FrameResult]:
+    """Decode an uploaded frame and detect its faces
+
+    Returns None if the upload is not a decodable image.
+    """
+    engine = get_engine()
+    timings = {}
+
+    start = time.perf_counter()
+    nparr = np.frombuffer(contents, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    timings['decode'] = (time.perf_counter() - start) * 1000
+    if image is None:
+        return None
+
+    detections = engine.detect(image, timings, run_inference=run_inference)
+    return FrameResult(detections.faces, detections.face_locations, engine.name, timings)
@@ -0,0 +1,150 @@
+# inference_scheduler.py
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceScheduler:
+    """Micro-batches normalized faces from concurrent requests.
+
+    Requests hand over faces that already went through
+    GazeEstimator.normalize_faces(). The scheduler waits up to max_wait_ms
+    for other requests to arrive, runs a single GazeEstimator forward pass
+    for up to max_batch_size faces, and resolves each request's future
+    once its own faces have their gaze filled in. on_batch, if given, is
+    called with the number of faces of each forward pass.
+
+    At most max_queue_depth requests wait for a batch (2 * max_batch_size
+    by default); beyond that predict raises asyncio.QueueFull, so a slow
+    forward pass pushes back on the clients instead of piling up requests.
+    """
+
+    def __init__(self, gaze_estimator, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 on_batch: Optional[Callable[[int], None]] = None, max_queue_depth: Optional[int] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be positive")
+        if max_queue_depth is None:
+            max_queue_depth = 2 * max_batch_size
+        self.gaze_estimator = gaze_estimator
+        self.max_batch_size = max_batch_size
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait_ms / 1000
+        self.on_batch = on_batch
+
+        self.total_batches = 0
+        self.total_faces = 0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # A request that didn't fit into the previous batch opens the next one
+        self._carried: Optional[Tuple[List, asyncio.Future]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        """Start the batching loop on the running event loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        # A single worker keeps forward passes sequential, so requests
+        # arriving during a forward pass are gathered into the next batch.
+        # It's created here, so the scheduler can be started again after stop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gaze-inference")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and fail the requests still waiting"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pending = [self._carried] if self._carried is not None else []
+        self._carried = None
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Inference scheduler stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def predict(self, faces: List) -> List:
+        """Fill in the gaze of normalized faces, batched with other requests
+
+        Raises asyncio.QueueFull when max_queue_depth requests are waiting.
+        """
+        if not faces:
+            return faces
+        if not self.running:
+            raise RuntimeError("Inference scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((faces, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._carried is not None:
+                batch = [self._carried]
+                self._carried = None
+            else:
+                batch = [await self._queue.get()]
+            n_faces = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_faces < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if n_faces + len(item[0]) > self.max_batch_size:
+                    self._carried = item
+                    break
+                batch.append(item)
+                n_faces += len(item[0])
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[Tuple[List, asyncio.Future]]):
+        # Requests that were cancelled while waiting don't need a forward pass
+        batch = [(faces, future) for faces, future in batch if not future.done()]
+        faces = [face for request_faces, _ in batch for face in request_faces]
+        if not faces:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._predict, faces)
+        except Exception as e:
+            logger.error(f"Batched gaze inference failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for request_faces, future in batch:
+            if not future.done():
+                future.set_result(request_faces)
+
+    def _predict(self, faces: List):
+        # A single request with more faces than max_batch_size is split
+        # into several forward passes to keep the memory footprint bounded
+        for start in range(0, len(faces), self.max_batch_size):
+            chunk = faces[start:start + self.max_batch_size]
+            self.gaze_estimator.predict_gaze(chunk)
+            self.total_batches += 1
+            self.total_faces += len(chunk)
+            if self.on_batch is not None:
+                self.on_batch(len(chunk))
@@ -0,0 +1,163 @@
+# metrics.py
+import abc
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast stage of a single frame to a request stuck in a queue
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _ThreadCells:
+    """One cell per thread, so updates need no lock
+
+    Each thread only ever mutates its own cell, and a scrape reads all of
+    them. Under the GIL, copying a dict or a list is atomic, so a scrape
+    sees every cell in a consistent state, at worst one update behind.
+    The cells of finished threads are kept, so the counters never go back.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells: List[Dict] = []
+
+    def get(self) -> Dict:
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = {}
+            self._local.cell = cell
+            self._cells.append(cell)
+        return cell
+
+    def items(self) -> List[Tuple]:
+        return [item for cell in list(self._cells) for item in list(cell.items())]
+
+
+class _Metric(abc.ABC):
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """The sample lines of the exposition format"""
+
+    def _labels(self, values: Tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._cells = _ThreadCells()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        cell = self._cells.get()
+        cell[labelvalues] = cell.get(labelvalues, 0) + amount
+
+    def _samples(self):
+        totals = {}
+        for labelvalues, value in self._cells.items():
+            totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return [f"{self.name}{self._labels(labelvalues)} {_format(value)}"
+                for labelvalues, value in sorted(totals.items())]
+
+
+class Gauge(_Metric):
+    """Read from a function when scraped, e.g. a queue depth"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self._function = function
+
+    def _samples(self):
+        return [f"{self.name} {_format(self._function())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._cells = _ThreadCells()
+
+    def observe(self, value: float, *labelvalues):
+        cell = self._cells.get()
+        # The counts of each bucket (the last one is +Inf), the sum and the count
+        state = cell.get(labelvalues)
+        if state is None:
+            state = [[0] * (len(self.buckets) + 1), 0., 0]
+            cell[labelvalues] = state
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self):
+        totals = {}
+        for labelvalues, (counts, total, count) in self._cells.items():
+            merged = totals.setdefault(labelvalues, [[0] * (len(self.buckets) + 1), 0., 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+        samples = []
+        for labelvalues, (counts, total, count) in sorted(totals.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf, ), counts):
+                cumulative += bucket_count
+                le = 'le="' + ("+Inf" if bound == math.inf else _format(bound)) + '"'
+                samples.append(f"{self.name}_bucket{self._labels(labelvalues, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{self._labels(labelvalues)} {_format(total)}")
+            samples.append(f"{self.name}_count{self._labels(labelvalues)} {count}")
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text format"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(self.prefix + name, documentation, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
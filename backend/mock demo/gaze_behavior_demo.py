@@ -25,6 +25,7 @@ class QuizSecureDemo:
         self.setup_ptgaze_demo()
         self.behavior_detector = BehaviorDetector()
         self.running = False
+        self.undistorted = None  # Reused for the undistorted frames
 
     def setup_ptgaze_demo(self):
         """Use the exact same setup as the working ptgaze command"""
@@ -38,6 +39,7 @@ class QuizSecureDemo:
                 video = None
                 camera = None
                 output_dir = None
+                results = None
                 ext = None
                 no_screen = True  # Don't show ptgaze's own display
                 debug = False
@@ -71,19 +73,22 @@ class QuizSecureDemo:
         try:
             # Use ptgaze's camera setup
             cap = self.ptgaze_demo.cap
-            if not cap or not cap.isOpened():
+            if not cap or not cap.is_opened():
                 raise RuntimeError("Cannot open camera")
 
             self.running = True
 
             while self.running:
-                # Use ptgaze's frame reading
-                ok, frame = cap.read()
-                if not ok:
+                # Use ptgaze's frame reading, which always gives the latest
+                # camera frame and drops the ones missed while processing
+                captured = cap.read()
+                if captured is None:
                     break
 
-                # Process with actual ptgaze system
-                processed_frame, gaze_data = self.process_with_ptgaze(frame)
+                # Process with actual ptgaze system, timing its stages
+                with self.ptgaze_demo.gaze_estimator.timer.frame():
+                    processed_frame, gaze_data = self.process_with_ptgaze(
+                        captured.image)
 
                 # Show the result
                 cv2.imshow('QuizSecure - Real ETH-XGaze Demo', processed_frame)
@@ -105,11 +110,11 @@ class QuizSecureDemo:
         """Process frame using actual ptgaze system"""
         try:
             # Use ptgaze's actual processing pipeline
-            undistorted = cv2.undistort(
-                frame,
-                self.ptgaze_demo.gaze_estimator.camera.camera_matrix,
-                self.ptgaze_demo.gaze_estimator.camera.dist_coefficients
+            undistorted = self.ptgaze_demo.gaze_estimator.undistort(
+                frame, out=self.undistorted
             )
+            if undistorted is not frame:
+                self.undistorted = undistorted
 
             # Set the frame for ptgaze visualizer
             self.ptgaze_demo.visualizer.set_image(frame.copy())
@@ -186,6 +191,9 @@ class QuizSecureDemo:
         """Clean up resources"""
         if hasattr(self, 'ptgaze_demo') and self.ptgaze_demo.cap:
             self.ptgaze_demo.cap.release()
+            logger.info(f"Frames captured: {self.ptgaze_demo.cap.n_read}, "
+                        f"dropped: {self.ptgaze_demo.cap.n_dropped}")
+            self.ptgaze_demo.gaze_estimator.timer.log_summary(logger)
         cv2.destroyAllWindows()
         logger.info("Demo cleanup completed")
 
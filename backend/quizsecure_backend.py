@@ -1,17 +1,24 @@
 # quizsecure_backend.py
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import cv2
 import numpy as np
 import base64
 import time
-from typing import Dict
+import asyncio
 import logging
+import os
 import sys
-from omegaconf import OmegaConf
 
 # Use the WORKING import method
 from ptgaze.gaze_estimator import GazeEstimator
+from ptgaze.timing import StageTimer
+
+from detection_engine import create_gaze_estimator_config
+from frame_executor import ExecutorSaturated, FrameExecutor
+from frame_worker import init_worker, process_frame
+from inference_scheduler import InferenceScheduler
+from metrics import CONTENT_TYPE, MetricsRegistry
+from session_store import InMemorySessionStore
 
 app = FastAPI(title="QuizSecure Gaze Monitoring API")
 
@@ -24,44 +31,127 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-
-def create_gaze_estimator_config():
-    """Create configuration for GazeEstimator"""
-    config = OmegaConf.create({
-        'device': 'cuda' if torch.cuda.is_available() else 'cpu',
-        'mode': 'MPIIFaceGaze',  # or 'MPIIGaze' or 'ETH-XGaze'
-        'face_detector': 'mediapipe',
-        'gaze_estimator': {
-            'checkpoint': None,  # Will use default model
-            'camera_params': None,  # Will use default camera params
-            'normalized_camera_params': None,
-            'normalized_camera_distance': 600,
-        }
-    })
-    return config
-
-
-# Initialize gaze estimator with config
-try:
-    import torch
-
-    config = create_gaze_estimator_config()
-    gaze_estimator = GazeEstimator(config)
-    print("✅ GazeEstimator initialized with CUDA support!")
-except Exception as e:
-    print(f"❌ GazeEstimator initialization failed: {e}")
-    # Let's try a simpler approach
+# Prometheus metrics served at /metrics. The counters and histograms are
+# updated without locks, see metrics.py.
+metrics = MetricsRegistry(prefix="quizsecure_")
+REQUESTS = metrics.counter("requests_total", "HTTP requests by route and status code", ["route", "status"])
+REQUEST_DURATION = metrics.histogram("request_duration_seconds", "HTTP request latency by route", ["route"])
+STAGE_DURATION = metrics.histogram("stage_duration_seconds", "Latency of the stages of monitored frames", ["stage"])
+DECODE_FAILURES = metrics.counter("decode_failures_total", "Uploaded frames that could not be decoded")
+INFERENCE_BATCH_SIZE = metrics.histogram("inference_batch_size", "Faces per shared forward pass",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template keeps the user IDs out of the labels
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUESTS.inc(path, str(status))
+        REQUEST_DURATION.observe(time.perf_counter() - start, path)
+
+
+# The gaze estimator, the inference scheduler and the frame executor are
+# built in the startup hook, not on import: the "process" executor spawns
+# workers that import this script again as __mp_main__, and they must not
+# load the gaze model or start executors of their own.
+config = None
+gaze_estimator = None
+inference_scheduler = None
+frame_executor = None
+
+
+def create_gaze_estimator():
+    """Load the config and the estimator running the shared forward passes
+
+    Returns (None, None) if ptgaze can't be loaded, and the frames are then
+    handled by the OpenCV face detection fallback.
+    """
     try:
-        from ptgaze import demo
+        config = create_gaze_estimator_config(os.environ.get("QUIZSECURE_GAZE_MODE", "MPIIFaceGaze"))
+        # The faces are detected by the executor workers, so the estimator
+        # of the main process only runs predict_gaze
+        gaze_estimator = GazeEstimator(config, detect_faces=False)
+        print(f"✅ GazeEstimator initialized on {config.device}!")
+        return config, gaze_estimator
+    except Exception as e:
+        print(f"❌ GazeEstimator initialization failed: {e}")
+        print("✅ Falling back to OpenCV face detection")
+        return None, None
+
+
+@app.on_event("startup")
+async def start_workers():
+    global config, gaze_estimator, inference_scheduler, frame_executor
+
+    config, gaze_estimator = create_gaze_estimator()
+
+    # Faces from concurrent requests are batched into shared forward passes
+    if gaze_estimator is not None:
+        inference_scheduler = InferenceScheduler(
+            gaze_estimator,
+            max_batch_size=int(os.environ.get("QUIZSECURE_MAX_BATCH_SIZE", 32)),
+            max_wait_ms=float(os.environ.get("QUIZSECURE_MAX_BATCH_WAIT_MS", 5)),
+            max_queue_depth=int(os.environ["QUIZSECURE_MAX_INFERENCE_QUEUE_DEPTH"])
+            if "QUIZSECURE_MAX_INFERENCE_QUEUE_DEPTH" in os.environ else None,
+            on_batch=INFERENCE_BATCH_SIZE.observe,
+        )
+
+    # Decoding, face detection and normalization run on a bounded pool of
+    # workers ("thread" or "process"), each loading its own detection engine
+    frame_executor = FrameExecutor(
+        kind=os.environ.get("QUIZSECURE_EXECUTOR", "thread"),
+        max_workers=int(os.environ["QUIZSECURE_WORKERS"]) if "QUIZSECURE_WORKERS" in os.environ else None,
+        max_queue_depth=int(os.environ["QUIZSECURE_MAX_QUEUE_DEPTH"])
+        if "QUIZSECURE_MAX_QUEUE_DEPTH" in os.environ else None,
+        initializer=init_worker,
+        # With the scheduler, the workers never run the forward pass
+        initargs=(config, inference_scheduler is None),
+    )
+
+    if inference_scheduler is not None:
+        await inference_scheduler.start()
+    await session_store.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await session_store.stop()
+    if inference_scheduler is not None:
+        await inference_scheduler.stop()
+    if frame_executor is not None:
+        frame_executor.shutdown()
+
+
+# Rolling latency percentiles of the stages of the requests
+request_latency = StageTimer()
+
+# User session storage, bounded in size and expiring idle sessions
+session_store = InMemorySessionStore(
+    ttl_seconds=float(os.environ.get("QUIZSECURE_SESSION_TTL", 7200)),
+    max_sessions=int(os.environ.get("QUIZSECURE_MAX_SESSIONS", 10000)),
+    sweep_interval=float(os.environ.get("QUIZSECURE_SESSION_SWEEP_INTERVAL", 60)),
+)
+# Sessions updated more recently than this are active
+SESSION_ACTIVE_SECONDS = 60
 
-        print("✅ Using ptgaze mock demo module instead")
-        gaze_estimator = None  # We'll handle this differently
-    except Exception as e2:
-        print(f"❌ Demo module also failed: {e2}")
-        gaze_estimator = None
 
-# User session storage
-user_sessions: Dict[str, Dict] = {}
+metrics.gauge("executor_in_flight", "Frames submitted to the executor and not finished",
+              lambda: frame_executor.in_flight if frame_executor else 0)
+metrics.gauge("executor_queue_depth", "Frames waiting for a free executor worker",
+              lambda: frame_executor.queue_depth if frame_executor else 0)
+metrics.gauge("inference_queue_depth", "Requests waiting for a shared forward pass",
+              lambda: inference_scheduler.queue_depth if inference_scheduler else 0)
+metrics.gauge("sessions", "Stored user sessions", lambda: len(session_store))
+metrics.gauge("active_sessions", f"User sessions updated in the last {SESSION_ACTIVE_SECONDS} seconds",
+              lambda: session_store.count_active(SESSION_ACTIVE_SECONDS))
 
 
 class SuspiciousBehaviorDetector:
@@ -84,37 +174,59 @@ class SuspiciousBehaviorDetector:
 detector = SuspiciousBehaviorDetector()
 
 
+def face_gaze_angles(face):
+    """Gaze pitch/yaw in degrees, averaging both eyes in MPIIGaze mode"""
+    if face.gaze_vector is not None:
+        gaze_vector = face.gaze_vector
+    else:
+        gaze_vector = face.reye.gaze_vector + face.leye.gaze_vector
+        gaze_vector = gaze_vector / np.linalg.norm(gaze_vector)
+    pitch, yaw = np.rad2deg(face.vector_to_angle(gaze_vector))
+    return {'pitch': float(pitch), 'yaw': float(yaw)}
+
+
 @app.post("/monitor-student")
 async def monitor_student(user_id: str, frame: UploadFile = File(...)):
     """Main endpoint for monitoring student during exam"""
     try:
         # Read uploaded image
         contents = await frame.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        if image is None:
+        start = time.perf_counter()
+        try:
+            # Without the scheduler the workers run the forward pass as well
+            result = await frame_executor.run(process_frame, contents, inference_scheduler is None)
+        except ExecutorSaturated:
+            raise HTTPException(status_code=429, detail="Server is busy, retry later",
+                                headers={"Retry-After": "1"})
+
+        if result is None:
+            DECODE_FAILURES.inc()
             raise HTTPException(status_code=400, detail="Invalid image data")
 
-        # Initialize user session
-        if user_id not in user_sessions:
-            user_sessions[user_id] = {
-                'warnings': 0,
-                'last_update': time.time(),
-                'alert_active': False,
-                'total_frames': 0
-            }
-
-        session = user_sessions[user_id]
-        session['last_update'] = time.time()
+        timings = result.timings
+        gaze = []
+        if result.faces is not None:
+            if inference_scheduler is not None:
+                # The forward pass is shared with faces from concurrent requests
+                inference_start = time.perf_counter()
+                try:
+                    await inference_scheduler.predict(result.faces)
+                except asyncio.QueueFull:
+                    raise HTTPException(status_code=429, detail="Server is busy, retry later",
+                                        headers={"Retry-After": "1"})
+                timings['inference'] = (time.perf_counter() - inference_start) * 1000
+            gaze = [face_gaze_angles(face) for face in result.faces]
+
+        # Get or initialize the user session, once the frame is accepted
+        session = session_store.touch(user_id)
         session['total_frames'] += 1
+        timings['total'] = (time.perf_counter() - start) * 1000
+        request_latency.add_frame({stage: duration / 1000 for stage, duration in timings.items()})
+        for stage, duration in timings.items():
+            STAGE_DURATION.observe(duration / 1000, stage)
+        face_locations = result.face_locations
 
-        # Basic face detection using OpenCV (fallback)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-
-        faces_detected = len(faces)
+        faces_detected = len(face_locations)
 
         # Analyze for suspicious behavior
         suspicious_behaviors = detector.analyze_basic_face_data(faces_detected)
@@ -140,16 +252,20 @@ async def monitor_student(user_id: str, frame: UploadFile = File(...)):
             'user_id': user_id,
             'timestamp': time.time(),
             'faces_detected': faces_detected,
-            'face_locations': [{'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)} for (x, y, w, h) in faces],
+            'face_locations': face_locations,
+            'gaze': gaze,
             'suspicious_behaviors': suspicious_behaviors,
             'warning_count': session['warnings'],
             'alert_level': alert_level,
             'total_frames_processed': session['total_frames'],
-            'detection_method': 'opencv_basic' if gaze_estimator is None else 'ptgaze_advanced'
+            'detection_method': result.detection_method,
+            'timings_ms': timings,
         }
 
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in monitor_student: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
@@ -158,33 +274,48 @@ async def monitor_student(user_id: str, frame: UploadFile = File(...)):
 @app.get("/student-status/{user_id}")
 async def get_student_status(user_id: str):
     """Get current monitoring status for a student"""
-    if user_id not in user_sessions:
+    session = session_store.get(user_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Student session not found")
 
-    session = user_sessions[user_id]
     return {
         'user_id': user_id,
         'warnings': session['warnings'],
         'alert_active': session['alert_active'],
         'last_update': session['last_update'],
         'total_frames': session['total_frames'],
-        'session_active': (time.time() - session['last_update']) < 60
+        'session_active': (time.time() - session['last_update']) < SESSION_ACTIVE_SECONDS
     }
 
 
 @app.post("/reset-session/{user_id}")
 async def reset_session(user_id: str):
     """Reset monitoring session for a student"""
-    if user_id in user_sessions:
-        user_sessions[user_id] = {
-            'warnings': 0,
-            'last_update': time.time(),
-            'alert_active': False,
-            'total_frames': 0
-        }
+    if user_id in session_store:
+        session_store.reset(user_id)
     return {"status": "success", "user_id": user_id}
 
 
+@app.get("/latency")
+async def get_latency():
+    """Rolling p50/p95/p99 latencies in milliseconds of each stage
+
+    With the inference scheduler, "inference" of the requests includes the
+    wait for a batch, and "batched_inference" has the stages of the shared
+    forward passes themselves.
+    """
+    return {
+        'requests': request_latency.summary(),
+        'batched_inference': gaze_estimator.timer.summary() if inference_scheduler else {},
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/system-info")
 async def get_system_info():
     """Get system information"""
@@ -194,8 +325,16 @@ async def get_system_info():
         'pytorch_version': torch.__version__,
         'cuda_available': torch.cuda.is_available(),
         'gpu_name': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
-        'total_sessions': len(user_sessions),
-        'gaze_estimator_available': gaze_estimator is not None
+        'total_sessions': len(session_store),
+        'expired_sessions': session_store.total_expired,
+        'evicted_sessions': session_store.total_evicted,
+        'gaze_estimator_available': gaze_estimator is not None,
+        'inference_batches': inference_scheduler.total_batches if inference_scheduler else 0,
+        'inference_faces': inference_scheduler.total_faces if inference_scheduler else 0,
+        'executor': frame_executor.kind,
+        'executor_in_flight': frame_executor.in_flight,
+        'executor_queue_depth': frame_executor.queue_depth,
+        'inference_queue_depth': inference_scheduler.queue_depth if inference_scheduler else 0,
     }
 
 
@@ -0,0 +1,150 @@
+# session_store.py
+import abc
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def new_session() -> Dict:
+    return {
+        'warnings': 0,
+        'last_update': time.time(),
+        'alert_active': False,
+        'total_frames': 0
+    }
+
+
+class SessionStore(abc.ABC):
+    """Monitoring sessions of the users, keyed by user ID"""
+
+    @abc.abstractmethod
+    def get(self, user_id: str) -> Optional[Dict]:
+        """The session of a user, or None if there's none or it expired"""
+
+    @abc.abstractmethod
+    def touch(self, user_id: str) -> Dict:
+        """The session of a user, created if needed, updated now"""
+
+    @abc.abstractmethod
+    def reset(self, user_id: str) -> Dict:
+        """Replace the session of a user with a new one"""
+
+    @abc.abstractmethod
+    def count_active(self, within_seconds: float) -> int:
+        """Number of sessions updated in the last within_seconds"""
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Number of stored sessions"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions expiring after ttl_seconds without updates, at most max_sessions
+
+    The sessions are kept in the order of their last update, so the expired
+    ones and the least recently updated one to evict are at the front, and
+    every lookup stays O(1). Expired sessions are dropped when they are
+    looked up, and a background task sweeps the others every
+    sweep_interval seconds. All the methods run on the event loop, so
+    there's no locking.
+    """
+
+    def __init__(self, ttl_seconds: float = 7200, max_sessions: int = 10000, sweep_interval: float = 60):
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be positive")
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+
+        self.total_expired = 0
+        self.total_evicted = 0
+
+        self._sessions: OrderedDict[str, Dict] = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is not None and self._expired(session, time.time()):
+            del self._sessions[user_id]
+            self.total_expired += 1
+            return None
+        return session
+
+    def touch(self, user_id):
+        session = self.get(user_id)
+        if session is None:
+            return self._insert(user_id, new_session())
+        session['last_update'] = time.time()
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def reset(self, user_id):
+        self._sessions.pop(user_id, None)
+        return self._insert(user_id, new_session())
+
+    def count_active(self, within_seconds):
+        now = time.time()
+        count = 0
+        # From the most recently updated, until the first inactive one
+        for session in reversed(self._sessions.values()):
+            if now - session['last_update'] >= min(within_seconds, self.ttl):
+                break
+            count += 1
+        return count
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def sweep(self) -> int:
+        """Drop the expired sessions and return how many there were"""
+        now = time.time()
+        n_expired = 0
+        while self._sessions and self._expired(next(iter(self._sessions.values())), now):
+            self._sessions.popitem(last=False)
+            n_expired += 1
+        self.total_expired += n_expired
+        return n_expired
+
+    async def start(self):
+        """Start sweeping on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _insert(self, user_id: str, session: Dict) -> Dict:
+        self._sessions[user_id] = session
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.total_evicted += 1
+        return session
+
+    def _expired(self, session: Dict, now: float) -> bool:
+        return now - session['last_update'] >= self.ttl
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            n_expired = self.sweep()
+            if n_expired:
+                logger.info(f"Expired {n_expired} sessions, {len(self._sessions)} left")
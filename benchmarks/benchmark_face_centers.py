@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Microbenchmark of the computation of the face and eye centers.
+
+Compares transforming the whole template model and averaging the corner
+points on every face, as done before, with transforming only the centers
+precomputed by FaceModel.
+"""
+import argparse
+import timeit
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from ptgaze.common import Face
+from ptgaze.common.face_model import FaceModel
+from ptgaze.common.face_model_68 import FaceModel68
+from ptgaze.common.face_model_mediapipe import FaceModelMediaPipe
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10000)
+    return parser.parse_args()
+
+
+def compute_centers_from_model3d(face_model: FaceModel, face: Face,
+                                 mode: str) -> None:
+    face_model.compute_3d_pose(face)
+    if mode == 'ETH-XGaze':
+        face.center = face.model3d[np.concatenate([
+            face_model.REYE_INDICES, face_model.LEYE_INDICES,
+            face_model.NOSE_INDICES
+        ])].mean(axis=0)
+    else:
+        face.center = face.model3d[np.concatenate([
+            face_model.REYE_INDICES, face_model.LEYE_INDICES,
+            face_model.MOUTH_INDICES
+        ])].mean(axis=0)
+    face.reye.center = face.model3d[face_model.REYE_INDICES].mean(axis=0)
+    face.leye.center = face.model3d[face_model.LEYE_INDICES].mean(axis=0)
+
+
+def create_face(face_model: FaceModel) -> Face:
+    face = Face(np.zeros((2, 2)), np.zeros((len(face_model.LANDMARKS), 2)))
+    face.head_pose_rot = Rotation.from_euler('XYZ', [0.1, np.pi + 0.2, 0.05])
+    face.head_position = np.array([0.05, -0.02, 0.6])
+    return face
+
+
+def main():
+    args = parse_args()
+    print(f'{"model":>10} {"mode":>13} {"before us":>10} {"after us":>9} '
+          f'{"max diff":>9}')
+    for face_model in [FaceModel68(), FaceModelMediaPipe()]:
+        name = f'{len(face_model.LANDMARKS)} points'
+        for mode in ['MPIIFaceGaze', 'ETH-XGaze']:
+            reference = create_face(face_model)
+            compute_centers_from_model3d(face_model, reference, mode)
+            face = create_face(face_model)
+            face_model.compute_face_eye_centers(face, mode)
+            diff = max(
+                np.abs(face.center - reference.center).max(),
+                np.abs(face.reye.center - reference.reye.center).max(),
+                np.abs(face.leye.center - reference.leye.center).max())
+
+            before = timeit.timeit(
+                lambda: compute_centers_from_model3d(face_model, face, mode),
+                number=args.repeat)
+            after = timeit.timeit(
+                lambda: face_model.compute_face_eye_centers(face, mode),
+                number=args.repeat)
+            print(f'{name:>10} {mode:>13} {before / args.repeat * 1e6:10.2f} '
+                  f'{after / args.repeat * 1e6:9.2f} {diff:9.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Compare the head pose estimator settings on a video.
+
+The faces of the video are tracked once, and the same landmarks are then
+fitted with every setting. Besides the time and the iterations per face,
+the mean reprojection error of all the landmarks and the median difference
+from the poses of cold-started cv2.solvePnP on all the landmarks, i.e. the
+original behavior, are reported.
+
+Example:
+    python benchmarks/benchmark_head_pose.py \
+        --video assets/inputs/video00.mp4 --n-frames 300
+"""
+import argparse
+import copy
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from omegaconf import DictConfig
+
+from ptgaze.common import Camera, Face
+from ptgaze.common.face_model import FaceModel
+from ptgaze.head_pose_estimation import (FaceTracker, HeadPoseEstimator,
+                                         LandmarkEstimator)
+from ptgaze.utils import get_3d_face_model, load_packaged_config
+
+SETTINGS = [
+    # (warm_start, use_stable_landmarks, solver)
+    (False, False, 'opencv'),
+    (True, False, 'opencv'),
+    (True, True, 'opencv'),
+    (False, False, 'batched'),
+    (True, False, 'batched'),
+    (True, True, 'batched'),
+]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', type=str, required=True)
+    parser.add_argument('--n-frames', type=int, default=300)
+    parser.add_argument('--detection-interval', type=int, default=10)
+    return parser.parse_args()
+
+
+def load_config(args: argparse.Namespace) -> DictConfig:
+    config = load_packaged_config('eth-xgaze')
+    config.face_detector.mode = 'mediapipe'
+    config.face_detector.detection_interval = args.detection_interval
+    return config
+
+
+def track_faces(config: DictConfig,
+                args: argparse.Namespace) -> List[List[Face]]:
+    tracker = FaceTracker(LandmarkEstimator(config), config)
+    cap = cv2.VideoCapture(args.video)
+    frames = []
+    while len(frames) < args.n_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(tracker.track(frame))
+    cap.release()
+    return frames
+
+
+def run(estimator: HeadPoseEstimator, frames: List[List[Face]],
+        face_model: FaceModel, camera: Camera) -> Tuple[np.ndarray, float]:
+    """Returns the poses and the mean reprojection error in pixels."""
+    frames = copy.deepcopy(frames)
+    poses = []
+    errors = []
+    for faces in frames:
+        estimator.estimate(faces)
+        for face in faces:
+            rvec = face.head_pose_rot.as_rotvec()
+            poses.append(np.hstack([rvec, face.head_position]))
+            points2d = camera.project_points(face_model.LANDMARKS, rvec,
+                                             face.head_position)
+            errors.append(
+                np.linalg.norm(points2d - face.landmarks, axis=1).mean())
+    return np.array(poses), float(np.mean(errors))
+
+
+def main():
+    args = parse_args()
+    config = load_config(args)
+    camera = Camera(config.gaze_estimator.camera_params)
+    face_model = get_3d_face_model(config)
+    frames = track_faces(config, args)
+    n_faces = sum(len(faces) for faces in frames)
+    print(f'{len(frames)} frames, {n_faces} faces')
+
+    print(f'{"warm":>5} {"stable":>6} {"solver":>8} {"ms/face":>8} '
+          f'{"iter/face":>9} {"reproj px":>9} {"rot diff deg":>12} '
+          f'{"pos diff mm":>11}')
+    reference = None
+    for warm_start, use_stable_landmarks, solver in SETTINGS:
+        config.head_pose_estimator.warm_start = warm_start
+        config.head_pose_estimator.use_stable_landmarks = use_stable_landmarks
+        config.head_pose_estimator.solver = solver
+        estimator = HeadPoseEstimator(face_model, camera, config)
+        poses, error = run(estimator, frames, face_model, camera)
+        if reference is None:
+            reference = poses
+        rot_diff = np.rad2deg(
+            np.median(np.linalg.norm(poses[:, :3] - reference[:, :3], axis=1)))
+        pos_diff = np.median(
+            np.linalg.norm(poses[:, 3:] - reference[:, 3:], axis=1)) * 1000
+        iterations = (f'{estimator.total_iterations / n_faces:9.2f}'
+                      if solver == 'batched' else f'{"-":>9}')
+        print(f'{str(warm_start):>5} {str(use_stable_landmarks):>6} '
+              f'{solver:>8} {estimator.total_time / n_faces * 1000:8.3f} '
+              f'{iterations} {error:9.2f} {rot_diff:12.4f} {pos_diff:11.3f}')
+
+
+if __name__ == '__main__':
+    main()
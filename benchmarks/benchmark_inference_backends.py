@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Compare the gaze model inference backends.
+
+For each backend, the load time, the latency per batch, and the max abs
+difference of the outputs from the eager PyTorch model are reported. The
+exported backends need the files created by `ptgaze export`.
+
+Example:
+    ptgaze export --mode eth-xgaze --format onnxruntime
+    python benchmarks/benchmark_inference_backends.py --mode eth-xgaze \
+        --backends pytorch torchscript onnxruntime
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+from omegaconf import DictConfig
+
+from ptgaze.export import create_example_inputs
+from ptgaze.models import load_inference_model
+from ptgaze.utils import (EXPORTED_MODEL_SUFFIXES, download_gaze_model,
+                          expanduser_all, load_config_file,
+                          load_packaged_config)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str)
+    parser.add_argument('--mode',
+                        type=str,
+                        choices=['mpiigaze', 'mpiifacegaze', 'eth-xgaze'])
+    parser.add_argument('--backends',
+                        type=str,
+                        nargs='+',
+                        default=['pytorch'] + sorted(EXPORTED_MODEL_SUFFIXES))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--threads',
+                        type=int,
+                        default=0,
+                        help='Intra-op threads of ONNX Runtime and PyTorch. '
+                        '0 keeps the defaults.')
+    return parser.parse_args()
+
+
+def load_config(args: argparse.Namespace) -> DictConfig:
+    if args.config:
+        config = load_config_file(args.config)
+    elif args.mode:
+        config = load_packaged_config(args.mode)
+        download_gaze_model(config)
+    else:
+        raise ValueError('One of --mode or --config is required.')
+    config.gaze_estimator.onnxruntime_intra_op_threads = args.threads
+    expanduser_all(config)
+    return config
+
+
+@torch.no_grad()
+def main():
+    args = parse_args()
+    config = load_config(args)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    inputs = {
+        batch_size: create_example_inputs(config, batch_size)
+        for batch_size in args.batch_sizes
+    }
+    references = None
+
+    print(f'{"backend":>12} {"load ms":>8} ' +
+          ' '.join(f'{f"bs{batch_size} ms":>8}'
+                   for batch_size in args.batch_sizes) + f' {"max diff":>9}')
+    for backend in args.backends:
+        backend_config = copy.deepcopy(config)
+        backend_config.gaze_estimator.inference_backend = backend
+        start = time.perf_counter()
+        try:
+            model = load_inference_model(backend_config)
+        except FileNotFoundError as e:
+            print(f'{backend:>12} skipped: {e}')
+            continue
+        load_time = time.perf_counter() - start
+
+        outputs = {}
+        latencies = []
+        for batch_size, batch in inputs.items():
+            outputs[batch_size] = model(*batch).cpu().numpy()
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                model(*batch)
+            latencies.append((time.perf_counter() - start) / args.repeat)
+        if references is None:
+            references = outputs
+        diff = max(
+            np.abs(outputs[batch_size] - references[batch_size]).max()
+            for batch_size in outputs)
+        print(f'{backend:>12} {load_time * 1000:8.1f} ' +
+              ' '.join(f'{latency * 1000:8.2f}'
+                       for latency in latencies) + f' {diff:9.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Microbenchmark of the conversion of mediapipe face mesh landmarks.
+
+Compares the per-landmark list comprehension with the bulk conversion
+used by LandmarkEstimator for 1, 3 and 10 faces per frame.
+"""
+import argparse
+import timeit
+
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from ptgaze.head_pose_estimation.face_landmark_estimator import \
+    _landmarks_to_array
+
+WIDTH = 1280
+HEIGHT = 720
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-faces', type=int, nargs='+', default=[1, 3, 10])
+    parser.add_argument('--n-points', type=int, default=468)
+    parser.add_argument('--repeat', type=int, default=1000)
+    return parser.parse_args()
+
+
+def create_landmark_list(
+        n_points: int,
+        rng: np.random.Generator) -> landmark_pb2.NormalizedLandmarkList:
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in rng.uniform(0, 1, size=(n_points, 3)):
+        landmark_list.landmark.add(x=x, y=y, z=z)
+    return landmark_list
+
+
+def convert_per_landmark(landmark_list) -> np.ndarray:
+    return np.array([(pt.x * WIDTH, pt.y * HEIGHT)
+                     for pt in landmark_list.landmark],
+                    dtype=np.float64)
+
+
+def convert_bulk(landmark_list) -> np.ndarray:
+    return _landmarks_to_array(landmark_list, WIDTH, HEIGHT)
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    print(f'{"faces":>5} {"per-landmark us":>16} {"bulk us":>9} '
+          f'{"speedup":>8}')
+    for n_faces in args.n_faces:
+        faces = [
+            create_landmark_list(args.n_points, rng) for _ in range(n_faces)
+        ]
+        for face in faces:
+            assert np.array_equal(convert_per_landmark(face),
+                                  convert_bulk(face))
+
+        def run_per_landmark():
+            return [convert_per_landmark(face) for face in faces]
+
+        def run_bulk():
+            return [convert_bulk(face) for face in faces]
+
+        times = []
+        for func in [run_per_landmark, run_bulk]:
+            elapsed = min(
+                timeit.repeat(func, number=args.repeat // 10, repeat=10))
+            times.append(elapsed / (args.repeat // 10) * 1e6)
+        print(f'{n_faces:5d} {times[0]:16.1f} {times[1]:9.1f} '
+              f'{times[0] / times[1]:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
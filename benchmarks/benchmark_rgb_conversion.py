@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Memory/latency benchmark of the BGR to RGB conversion per frame.
+
+Compares the conversions LandmarkEstimator used to do for the dlib and
+face_alignment detectors, where the detector and the landmark predictor
+each got their own reversed view that ends up being copied, with the
+single conversion into a reused buffer.
+"""
+import argparse
+import time
+import tracemalloc
+from typing import List, Tuple
+
+import numpy as np
+
+from ptgaze.head_pose_estimation.face_landmark_estimator import _bgr_to_rgb
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--n-frames', type=int, default=200)
+    return parser.parse_args()
+
+
+def convert_twice_with_copies(image: np.ndarray, state: dict) -> None:
+    # Detector and predictor each receive image[:, :, ::-1], which has to
+    # be made contiguous before it can be processed.
+    np.ascontiguousarray(image[:, :, ::-1])
+    np.ascontiguousarray(image[:, :, ::-1])
+
+
+def convert_once_into_buffer(image: np.ndarray, state: dict) -> None:
+    state['buffer'] = _bgr_to_rgb(image, state.get('buffer'))
+
+
+def measure(func, frames: List[np.ndarray]) -> Tuple[float, float]:
+    state = {}
+    func(frames[0], state)  # warm up and allocate the reused buffer
+    tracemalloc.start()
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame, state)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / len(frames) * 1000, peak / 2**20
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(0, 256, size=(args.height, args.width, 3), dtype=np.uint8)
+        for _ in range(4)
+    ]
+    frames = [frames[i % len(frames)] for i in range(args.n_frames)]
+    print(f'{args.width}x{args.height}, {args.n_frames} frames')
+    print(f'{"method":>28} {"ms/frame":>9} {"peak MiB":>9}')
+    for name, func in [('two reversed copies', convert_twice_with_copies),
+                       ('one conversion into buffer', convert_once_into_buffer)
+                       ]:
+        latency, peak = measure(func, frames)
+        print(f'{name:>28} {latency:9.2f} {peak:9.2f}')
+
+
+if __name__ == '__main__':
+    main()
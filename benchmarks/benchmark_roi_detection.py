@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Compare the two-stage ROI landmark detection with full-frame detection.
+
+Both modes run on the same frames. The full-frame landmarks are used as
+the reference for the landmark error of the ROI mode. The ROI mode isn't
+supported by mediapipe, whose face mesh already detects the faces on a
+downscaled frame.
+
+Example:
+    python benchmarks/benchmark_roi_detection.py \
+        --face-detector dlib --video assets/inputs/video00.mp4 \
+        --resize 1920 1080 --scales 0.25 0.5
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from omegaconf import DictConfig
+
+from ptgaze.common import Face
+from ptgaze.head_pose_estimation import LandmarkEstimator
+from ptgaze.utils import (download_dlib_pretrained_model, expanduser_all,
+                          load_packaged_config)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--face-detector',
+                        type=str,
+                        default='dlib',
+                        choices=[
+                            'dlib', 'face_alignment_dlib',
+                            'face_alignment_sfd'
+                        ])
+    parser.add_argument('--device',
+                        type=str,
+                        default='cpu',
+                        choices=['cpu', 'cuda'])
+    parser.add_argument('--image', type=str)
+    parser.add_argument('--video', type=str)
+    parser.add_argument('--n-frames', type=int, default=100)
+    parser.add_argument('--resize',
+                        type=int,
+                        nargs=2,
+                        metavar=('WIDTH', 'HEIGHT'),
+                        help='Resize the input frames, e.g. to 1920 1080 '
+                        'to simulate a high-resolution camera.')
+    parser.add_argument('--scales',
+                        type=float,
+                        nargs='+',
+                        default=[0.25, 0.5],
+                        help='Detection scales of the ROI mode to compare.')
+    return parser.parse_args()
+
+
+def load_config(args: argparse.Namespace) -> DictConfig:
+    config = load_packaged_config('eth-xgaze')
+    config.face_detector.mode = args.face_detector
+    config.device = args.device
+    expanduser_all(config)
+    if args.face_detector == 'dlib':
+        download_dlib_pretrained_model()
+    return config
+
+
+def load_frames(args: argparse.Namespace) -> List[np.ndarray]:
+    if args.image:
+        frames = [cv2.imread(args.image)] * args.n_frames
+    elif args.video:
+        cap = cv2.VideoCapture(args.video)
+        frames = []
+        while len(frames) < args.n_frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    else:
+        raise ValueError('One of --image or --video is required.')
+    if args.resize:
+        frames = [cv2.resize(frame, tuple(args.resize)) for frame in frames]
+    return frames
+
+
+def run(estimator: LandmarkEstimator,
+        frames: List[np.ndarray]) -> Tuple[List[List[Face]], np.ndarray]:
+    results = []
+    latencies = []
+    for frame in frames:
+        start = time.perf_counter()
+        results.append(estimator.detect_faces(frame))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def compute_iou(bbox0: np.ndarray, bbox1: np.ndarray) -> float:
+    top_left = np.maximum(bbox0[0], bbox1[0])
+    bottom_right = np.minimum(bbox0[1], bbox1[1])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None))
+    union = (np.prod(bbox0[1] - bbox0[0]) + np.prod(bbox1[1] - bbox1[0]) -
+             intersection)
+    return float(intersection / union) if union > 0 else 0.
+
+
+def compare(reference: List[List[Face]],
+            results: List[List[Face]]) -> Tuple[float, float, float]:
+    """Returns the recall of the reference faces, and the mean landmark
+    error in pixels and relative to the face size."""
+    n_reference = 0
+    n_matched = 0
+    errors = []
+    relative_errors = []
+    for ref_faces, faces in zip(reference, results):
+        n_reference += len(ref_faces)
+        for ref_face in ref_faces:
+            ious = [compute_iou(ref_face.bbox, face.bbox) for face in faces]
+            if not ious or max(ious) < 0.3:
+                continue
+            n_matched += 1
+            face = faces[int(np.argmax(ious))]
+            error = np.linalg.norm(face.landmarks - ref_face.landmarks,
+                                   axis=1).mean()
+            face_size = np.linalg.norm(ref_face.bbox[1] - ref_face.bbox[0])
+            errors.append(error)
+            relative_errors.append(error / face_size)
+    recall = n_matched / n_reference if n_reference else float('nan')
+    if not errors:
+        return recall, float('nan'), float('nan')
+    return recall, float(np.mean(errors)), float(np.mean(relative_errors))
+
+
+def main():
+    args = parse_args()
+    config = load_config(args)
+    frames = load_frames(args)
+    h, w = frames[0].shape[:2]
+    print(f'{len(frames)} frames of {w}x{h}, '
+          f'face detector: {args.face_detector}')
+
+    config.face_detector.roi_detection = False
+    reference, latencies = run(LandmarkEstimator(config), frames)
+    print(f'{"mode":>12} {"mean ms":>9} {"p95 ms":>9} {"recall":>7} '
+          f'{"err px":>8} {"err rel":>8}')
+    print(f'{"full-frame":>12} {latencies.mean():9.2f} '
+          f'{np.percentile(latencies, 95):9.2f} {"-":>7} {"-":>8} {"-":>8}')
+
+    config.face_detector.roi_detection = True
+    for scale in args.scales:
+        config.face_detector.roi_detection_scale = scale
+        results, latencies = run(LandmarkEstimator(config), frames)
+        recall, error, relative_error = compare(reference, results)
+        print(f'{f"roi x{scale}":>12} {latencies.mean():9.2f} '
+              f'{np.percentile(latencies, 95):9.2f} {recall:7.3f} '
+              f'{error:8.2f} {relative_error:8.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Compare cv2.undistort with Camera.undistort, which caches the maps.
+
+The camera parameters are those of the sample calibration with the given
+distortion coefficients, since the sample has no distortion.
+
+Example:
+    python benchmarks/benchmark_undistort.py --width 1280 --height 720
+"""
+import argparse
+import pathlib
+import tempfile
+import timeit
+
+import cv2
+import numpy as np
+import yaml
+
+import ptgaze
+from ptgaze.common import Camera
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--dist-coefficients',
+                        type=float,
+                        nargs=5,
+                        default=[-0.3, 0.1, 0.001, -0.001, 0.])
+    parser.add_argument('--repeat', type=int, default=200)
+    return parser.parse_args()
+
+
+def create_camera(args: argparse.Namespace) -> Camera:
+    package_root = pathlib.Path(ptgaze.__file__).parent
+    with open(package_root / 'data/calib/sample_params.yaml') as f:
+        params = yaml.safe_load(f)
+    params['distortion_coefficients']['data'] = args.dist_coefficients
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml') as f:
+        yaml.safe_dump(params, f)
+        return Camera(f.name)
+
+
+def main():
+    args = parse_args()
+    camera = create_camera(args)
+    image = np.random.default_rng(0).integers(0,
+                                              256,
+                                              (args.height, args.width, 3),
+                                              dtype=np.uint8)
+
+    expected = cv2.undistort(image, camera.camera_matrix,
+                             camera.dist_coefficients)
+    out = np.empty_like(image)
+    actual = camera.undistort(image, out=out)
+    diff = np.abs(actual.astype(int) - expected).max()
+
+    before = timeit.timeit(lambda: cv2.undistort(image, camera.camera_matrix,
+                                                 camera.dist_coefficients),
+                           number=args.repeat)
+    after = timeit.timeit(lambda: camera.undistort(image, out=out),
+                          number=args.repeat)
+    print(f'{"cv2.undistort ms":>16} {"Camera.undistort ms":>19} '
+          f'{"max diff":>8}')
+    print(f'{before / args.repeat * 1000:16.3f} '
+          f'{after / args.repeat * 1000:19.3f} {diff:8d}')
+
+
+if __name__ == '__main__':
+    main()
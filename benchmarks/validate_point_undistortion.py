@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""Validate the estimation on raw frames with undistorted landmarks.
+
+The frames of a video are cropped and resized to the sample calibration, and
+distorted with the given distortion coefficients to simulate raw frames.
+They are then processed in three ways:
+
+- reference: the original frames with a camera without distortion
+- image: the raw frames undistorted as a whole (the default)
+- points: the raw frames with ``gaze_estimator.undistort_points``
+
+The differences of the head poses and the gazes from the reference, and the
+time spent undistorting and normalizing per frame are reported.
+
+Example:
+    python benchmarks/validate_point_undistortion.py \
+        --video assets/inputs/video00.mp4 --n-frames 50 \
+        --dist-coefficients -0.3 0.1 0.001 -0.001 0
+"""
+import argparse
+import copy
+import pathlib
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+import yaml
+from omegaconf import DictConfig
+
+from ptgaze.common import Camera, Face
+from ptgaze.gaze_estimator import GazeEstimator
+from ptgaze.utils import (download_gaze_model, expanduser_all,
+                          load_packaged_config)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', type=str, required=True)
+    parser.add_argument('--n-frames', type=int, default=50)
+    parser.add_argument('--mode',
+                        type=str,
+                        default='eth-xgaze',
+                        choices=['mpiigaze', 'mpiifacegaze', 'eth-xgaze'])
+    parser.add_argument(
+        '--dist-coefficients',
+        type=float,
+        nargs=5,
+        help='Distortion coefficients. Defaults to those of the sample '
+        'calibration.')
+    return parser.parse_args()
+
+
+def write_camera_params(path: pathlib.Path,
+                        dist_coefficients: Optional[List[float]]) -> str:
+    with open(path) as f:
+        params = yaml.safe_load(f)
+    if dist_coefficients is not None:
+        params['distortion_coefficients']['data'] = dist_coefficients
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as f:
+        yaml.safe_dump(params, f)
+    return f.name
+
+
+def create_estimators(args: argparse.Namespace) -> Dict[str, GazeEstimator]:
+    config = load_packaged_config(args.mode)
+    config.face_detector.mode = 'mediapipe'
+    download_gaze_model(config)
+    expanduser_all(config)
+    sample_path = pathlib.Path(
+        config.PACKAGE_ROOT) / 'data/calib/sample_params.yaml'
+
+    estimators = {}
+    for name in ['reference', 'image', 'points']:
+        estimator_config: DictConfig = copy.deepcopy(config)
+        estimator_config.gaze_estimator.camera_params = write_camera_params(
+            sample_path,
+            [0.] * 5 if name == 'reference' else args.dist_coefficients)
+        estimator_config.gaze_estimator.undistort_points = name == 'points'
+        estimators[name] = GazeEstimator(estimator_config)
+    return estimators
+
+
+def load_frames(args: argparse.Namespace, camera: Camera) -> List[np.ndarray]:
+    """Crop the frames to the aspect ratio of the camera and resize them."""
+    cap = cv2.VideoCapture(args.video)
+    frames = []
+    while len(frames) < args.n_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        height, width = frame.shape[:2]
+        crop_width = min(width, height * camera.width // camera.height)
+        crop_height = crop_width * camera.height // camera.width
+        x0 = (width - crop_width) // 2
+        y0 = (height - crop_height) // 2
+        frame = frame[y0:y0 + crop_height, x0:x0 + crop_width]
+        frames.append(cv2.resize(frame, (camera.width, camera.height)))
+    cap.release()
+    return frames
+
+
+def distort(frames: List[np.ndarray], camera: Camera) -> List[np.ndarray]:
+    """Simulate the raw frames of the camera."""
+    xs, ys = np.meshgrid(np.arange(camera.width, dtype=np.float32),
+                         np.arange(camera.height, dtype=np.float32))
+    pixels = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2)
+    # Each raw pixel is sampled from its undistorted position.
+    maps = cv2.undistortPoints(pixels,
+                               camera.camera_matrix,
+                               camera.dist_coefficients,
+                               P=camera.camera_matrix).reshape(
+                                   camera.height, camera.width, 2)
+    return [cv2.remap(frame, maps, None, cv2.INTER_LINEAR) for frame in frames]
+
+
+def compute_gaze_vector(face: Face) -> np.ndarray:
+    if face.gaze_vector is not None:
+        return face.gaze_vector
+    vector = face.reye.gaze_vector + face.leye.gaze_vector
+    return vector / np.linalg.norm(vector)
+
+
+def angle_between(vector0: np.ndarray, vector1: np.ndarray) -> float:
+    cos = vector0 @ vector1 / np.linalg.norm(vector0) / np.linalg.norm(vector1)
+    return float(np.rad2deg(np.arccos(np.clip(cos, -1, 1))))
+
+
+def main():
+    args = parse_args()
+    estimators = create_estimators(args)
+    frames = load_frames(args, estimators['reference'].camera)
+    raw_frames = distort(frames, estimators['image'].camera)
+
+    errors = {name: [] for name in ['image', 'points']}
+    times = {name: [] for name in ['image', 'points']}
+    n_faces = 0
+    for frame, raw_frame in zip(frames, raw_frames):
+        reference = estimators['reference']
+        reference_faces = reference.detect_faces(frame)
+        reference.estimate_gaze_batch(frame, reference_faces)
+        n_faces += len(reference_faces)
+        for name in ['image', 'points']:
+            estimator = estimators[name]
+            start = time.perf_counter()
+            image = estimator.undistort(raw_frame)
+            elapsed = time.perf_counter() - start
+            faces = estimator.detect_faces(image)
+            start = time.perf_counter()
+            estimator.normalize_faces(image, faces)
+            times[name].append(elapsed + time.perf_counter() - start)
+            estimator.predict_gaze(faces)
+
+            for face in faces:
+                if not reference_faces:
+                    break
+                # Match the faces by their positions.
+                reference_face = min(
+                    reference_faces,
+                    key=lambda ref: np.linalg.norm(ref.head_position - face.
+                                                   head_position))
+                rot_diff = (face.head_pose_rot *
+                            reference_face.head_pose_rot.inv()).magnitude()
+                errors[name].append([
+                    np.rad2deg(rot_diff),
+                    np.linalg.norm(face.head_position -
+                                   reference_face.head_position) * 1000,
+                    angle_between(compute_gaze_vector(face),
+                                  compute_gaze_vector(reference_face)),
+                ])
+
+    camera = estimators['image'].camera
+    print(f'{len(frames)} frames, {n_faces} faces, distortion coefficients '
+          f'{camera.dist_coefficients.ravel().tolist()}')
+    print(f'{"path":>6} {"head rot deg":>12} {"head pos mm":>11} '
+          f'{"gaze deg":>8} {"undistort+normalize ms":>22}')
+    for name in ['image', 'points']:
+        rot_diff, pos_diff, gaze_diff = np.median(np.array(errors[name]),
+                                                  axis=0)
+        print(f'{name:>6} {rot_diff:12.3f} {pos_diff:11.2f} {gaze_diff:8.3f} '
+              f'{np.mean(times[name]) * 1000:22.3f}')
+    print('The differences are the medians over the faces.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
 import ptgaze.main
 
-ptgaze.main.main()
+if __name__ == '__main__':
+    ptgaze.main.main()
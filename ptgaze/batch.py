@@ -0,0 +1,613 @@
+"""Process video files offline, without a display.
+
+Decoding, gaze estimation and encoding of the overlay video run as pipelined
+stages on separate threads connected by bounded queues, e.g.
+
+    ptgaze batch --mode eth-xgaze -o outputs exam01.mp4 exam02.mp4
+
+The inputs can also be directories or glob patterns. With ``--processes P``,
+the videos are spread over P processes, which load the models once, and
+long videos are split into shards of ``--shard-frames`` frames whose outputs
+are concatenated afterwards.
+
+With ``--results-format``, the estimated head poses and gazes are saved
+per face, see ``ptgaze.results``. ``--no-overlay`` then skips drawing and
+encoding the overlay videos.
+
+OpenCV, PyTorch and ONNX Runtime release the GIL during the heavy work, so
+the stages overlap. With ``--workers N``, N gaze estimators process the
+frames concurrently. Frame ``i`` always goes to worker ``i % N``, so the
+encoder gets the frames back in order by reading the workers round-robin.
+"""
+import argparse
+import collections
+import concurrent.futures
+import copy
+import dataclasses
+import glob
+import logging
+import multiprocessing
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import torch
+from omegaconf import DictConfig, OmegaConf
+
+from .common import Camera, Face, Visualizer
+from .gaze_estimator import GazeEstimator
+from .results import (RESULTS_FORMATS, ResultsWriter, create_results_writer,
+                      merge_results, resolve_results_path)
+from .utils import (check_path_all, create_dummy_camera,
+                    download_dlib_pretrained_model, download_gaze_model,
+                    expanduser_all, generate_dummy_camera_params,
+                    get_3d_face_model, load_config_file,
+                    load_packaged_config)
+from .video_writer import FOURCCS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {'.avi', '.mkv', '.mov', '.mp4', '.webm'}
+
+# Marks the end of the frames in the queues
+_END = None
+
+
+class _Aborted(Exception):
+    pass
+
+
+class BatchProcessor:
+    def __init__(self,
+                 config: DictConfig,
+                 n_workers: int = 1,
+                 queue_size: int = 16):
+        if n_workers > 1 and config.face_detector.track_faces:
+            # The workers see only every n-th frame.
+            logger.warning('Face tracking is disabled with multiple workers.')
+            config = copy.deepcopy(config)
+            config.face_detector.track_faces = False
+        if n_workers > 1 and config.device == 'cpu':
+            # Share the cores between the workers instead of oversubscribing.
+            torch.set_num_threads(max(1, torch.get_num_threads() // n_workers))
+        self._config = config
+        self._queue_size = queue_size
+        self._estimators = [GazeEstimator(config) for _ in range(n_workers)]
+        self._nose_index = get_3d_face_model(config).NOSE_INDEX
+        self._set_camera(self._estimators[0].camera)
+
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self._errors: List[BaseException] = []
+
+        # The seconds each stage spent working, summed over the workers
+        self.stage_times: Dict[str, float] = collections.Counter()
+
+    def process(self,
+                video_path: str,
+                output_path: Optional[str],
+                results_path: Optional[str] = None,
+                start_frame: int = 0,
+                end_frame: Optional[int] = None) -> int:
+        """Write the overlay video and the results, and return the number of
+        frames.
+
+        Only the frames in ``[start_frame, end_frame)`` are processed.
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise RuntimeError(f'{video_path} is not opened.')
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        max_frames = None if end_frame is None else end_frame - start_frame
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if size != (self._camera.width, self._camera.height):
+            if self._config.gaze_estimator.use_dummy_camera_params:
+                # Without calibration, the camera is derived from the frame
+                # size, so each video size gets its own.
+                self._set_camera(create_dummy_camera(*size))
+            else:
+                logger.warning(f'The frame size {size} of {video_path} '
+                               f'differs from the camera parameters.')
+        writer = None
+        if output_path:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            ext = pathlib.Path(output_path).suffix[1:]
+            writer = cv2.VideoWriter(output_path,
+                                     cv2.VideoWriter_fourcc(*FOURCCS[ext]),
+                                     fps, size)
+        results_writer = None
+        if results_path:
+            results_writer = create_results_writer(results_path)
+        for estimator in self._estimators:
+            estimator.reset()
+
+        self._abort.clear()
+        self._errors = []
+        decoded = [
+            queue.Queue(maxsize=self._queue_size) for _ in self._estimators
+        ]
+        estimated = [
+            queue.Queue(maxsize=self._queue_size) for _ in self._estimators
+        ]
+        counter = [0]
+        threads = [
+            threading.Thread(target=self._run_stage,
+                             args=('decode', self._decode, cap, decoded,
+                                   start_frame, max_frames)),
+            threading.Thread(target=self._run_stage,
+                             args=('encode', self._encode, estimated, writer,
+                                   results_writer, counter)),
+        ]
+        for estimator, inputs, outputs in zip(self._estimators, decoded,
+                                              estimated):
+            threads.append(
+                threading.Thread(target=self._run_stage,
+                                 args=('estimate', self._estimate, estimator,
+                                       inputs, outputs)))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cap.release()
+        if writer:
+            writer.release()
+        if results_writer:
+            results_writer.close()
+        if self._errors:
+            raise self._errors[0]
+        return counter[0]
+
+    def _set_camera(self, camera: Camera) -> None:
+        self._camera = camera
+        for estimator in self._estimators:
+            estimator.set_camera(camera)
+        self._visualizer = Visualizer(camera, self._nose_index)
+
+    def _run_stage(self, name: str, stage: Callable[..., float],
+                   *args) -> None:
+        """Run a stage, which returns the seconds it spent working."""
+        try:
+            busy_time = stage(*args)
+        except _Aborted:
+            return
+        except BaseException as e:
+            self._errors.append(e)
+            self._abort.set()
+            return
+        with self._lock:
+            self.stage_times[name] += busy_time
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._abort.is_set():
+                    raise _Aborted
+
+    def _get(self, q: queue.Queue):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._abort.is_set():
+                    raise _Aborted
+
+    def _decode(self, cap: cv2.VideoCapture, outputs: List[queue.Queue],
+                start_frame: int, max_frames: Optional[int]) -> float:
+        estimator = self._estimators[0]
+        busy_time = 0.
+        index = 0
+        while max_frames is None or index < max_frames:
+            start = time.perf_counter()
+            ok, frame = cap.read()
+            if not ok:
+                break
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            # The frames are in flight on other threads, so the output
+            # buffer isn't reused.
+            undistorted = estimator.undistort(frame)
+            busy_time += time.perf_counter() - start
+            self._put(outputs[index % len(outputs)],
+                      (start_frame + index, timestamp, frame, undistorted))
+            index += 1
+        for q in outputs:
+            self._put(q, _END)
+        return busy_time
+
+    def _estimate(self, estimator: GazeEstimator, inputs: queue.Queue,
+                  outputs: queue.Queue) -> float:
+        busy_time = 0.
+        while True:
+            item = self._get(inputs)
+            if item is _END:
+                break
+            frame_index, timestamp, frame, undistorted = item
+            start = time.perf_counter()
+            faces = estimator.track_faces(undistorted)
+            estimator.estimate_gaze_batch(undistorted, faces)
+            busy_time += time.perf_counter() - start
+            self._put(outputs, (frame_index, timestamp, frame, faces))
+        self._put(outputs, _END)
+        return busy_time
+
+    def _encode(self, inputs: List[queue.Queue],
+                writer: Optional[cv2.VideoWriter],
+                results_writer: Optional[ResultsWriter],
+                counter: List[int]) -> float:
+        busy_time = 0.
+        while True:
+            item = self._get(inputs[counter[0] % len(inputs)])
+            if item is _END:
+                break
+            frame_index, timestamp, frame, faces = item
+            start = time.perf_counter()
+            if results_writer:
+                results_writer.add(frame_index, timestamp, faces)
+            if writer:
+                self._visualizer.set_image(frame)
+                for face in faces:
+                    self._draw(face)
+                writer.write(frame)
+            busy_time += time.perf_counter() - start
+            counter[0] += 1
+        return busy_time
+
+    def _draw(self, face: Face) -> None:
+        demo_config = self._config.demo
+        if demo_config.show_bbox:
+            self._visualizer.draw_bbox(face.bbox)
+        if demo_config.show_head_pose:
+            self._visualizer.draw_model_axes(face,
+                                             demo_config.head_pose_axis_length,
+                                             lw=2)
+        if demo_config.show_landmarks:
+            self._visualizer.draw_points(face.landmarks,
+                                         color=(0, 255, 255),
+                                         size=1)
+        length = demo_config.gaze_visualization_length
+        if self._config.mode == 'MPIIGaze':
+            for key in GazeEstimator.EYE_KEYS:
+                eye = getattr(face, key.name.lower())
+                self._visualizer.draw_3d_line(
+                    eye.center, eye.center + length * eye.gaze_vector)
+        else:
+            self._visualizer.draw_3d_line(
+                face.center, face.center + length * face.gaze_vector)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='ptgaze batch')
+    parser.add_argument(
+        'videos',
+        type=str,
+        nargs='+',
+        help='Video files, directories containing videos or glob patterns.')
+    parser.add_argument('--config',
+                        type=str,
+                        help='Config file. When using a config file, --mode, '
+                        '--face-detector, --device and --camera are ignored.')
+    parser.add_argument('--mode',
+                        type=str,
+                        choices=['mpiigaze', 'mpiifacegaze', 'eth-xgaze'])
+    parser.add_argument('--face-detector',
+                        type=str,
+                        default='mediapipe',
+                        choices=[
+                            'dlib', 'face_alignment_dlib',
+                            'face_alignment_sfd', 'mediapipe'
+                        ])
+    parser.add_argument('--device', type=str, choices=['cpu', 'cuda'])
+    parser.add_argument(
+        '--camera',
+        type=str,
+        help='Camera calibration file. Without it, dummy camera parameters '
+        'are generated from the first video.')
+    parser.add_argument('--output-dir', '-o', type=str, default='outputs')
+    parser.add_argument('--ext', '-e', type=str, choices=sorted(FOURCCS))
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='Number of gaze estimators running in parallel.')
+    parser.add_argument(
+        '--results-format',
+        type=str,
+        choices=RESULTS_FORMATS,
+        help='If specified, the results of each video are saved to the '
+        'output directory in this format.')
+    parser.add_argument('--no-overlay',
+                        action='store_true',
+                        help='Don\'t save the overlay videos.')
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='Number of processes the videos are spread over.')
+    parser.add_argument(
+        '--shard-frames',
+        type=int,
+        default=9000,
+        help='With multiple processes, videos longer than this are split '
+        'into shards of this many frames.')
+    return parser.parse_args(argv)
+
+
+def find_videos(inputs: List[str]) -> List[pathlib.Path]:
+    paths = []
+    for input_ in inputs:
+        path = pathlib.Path(input_).expanduser()
+        if path.is_dir():
+            paths.extend(
+                sorted(child for child in path.iterdir()
+                       if child.suffix.lower() in VIDEO_EXTENSIONS))
+        elif path.is_file():
+            paths.append(path)
+        else:
+            matches = sorted(glob.glob(path.as_posix(), recursive=True))
+            if not matches:
+                raise FileNotFoundError(f'{input_} not found.')
+            paths.extend(map(pathlib.Path, matches))
+    if not paths:
+        raise FileNotFoundError('No videos found.')
+    stems = collections.Counter(path.stem for path in paths)
+    duplicates = sorted(stem for stem, count in stems.items() if count > 1)
+    if duplicates:
+        raise ValueError(f'The output names would collide: {duplicates}')
+    return paths
+
+
+def load_config(args: argparse.Namespace,
+                video_paths: List[pathlib.Path]) -> DictConfig:
+    if args.config:
+        config = load_config_file(args.config)
+    elif args.mode:
+        config = load_packaged_config(args.mode)
+        config.face_detector.mode = args.face_detector
+        if args.device:
+            config.device = args.device
+        if config.device == 'cuda' and not torch.cuda.is_available():
+            config.device = 'cpu'
+            logger.warning('Run on CPU because CUDA is not available.')
+        if args.camera:
+            config.gaze_estimator.camera_params = args.camera
+        else:
+            config.gaze_estimator.use_dummy_camera_params = True
+    else:
+        raise ValueError(
+            'You need to specify one of \'--mode\' or \'--config\'.')
+    config.demo.use_camera = False
+    config.demo.display_on_screen = False
+    config.demo.image_path = None
+    config.demo.video_path = video_paths[0].as_posix()
+    config.demo.output_dir = args.output_dir
+    if args.ext:
+        config.demo.output_file_extension = args.ext
+    expanduser_all(config)
+    if config.gaze_estimator.use_dummy_camera_params:
+        generate_dummy_camera_params(config)
+
+    if config.face_detector.mode == 'dlib':
+        download_dlib_pretrained_model()
+    if args.mode:
+        download_gaze_model(config)
+    check_path_all(config)
+    return config
+
+
+@dataclasses.dataclass
+class Shard:
+    video_path: str
+    output_path: Optional[str]
+    results_path: Optional[str]
+    start_frame: int = 0
+    end_frame: Optional[int] = None
+
+
+def _get_part_path(path: Optional[pathlib.Path],
+                   index: Optional[int]) -> Optional[str]:
+    if path is None:
+        return None
+    if index is None:
+        return path.as_posix()
+    return path.with_suffix(f'.part{index:03d}{path.suffix}').as_posix()
+
+
+def split_video(video_path: pathlib.Path, output_path: Optional[pathlib.Path],
+                results_path: Optional[pathlib.Path],
+                shard_frames: Optional[int]) -> List[Shard]:
+    n_frames = 0
+    if shard_frames:
+        cap = cv2.VideoCapture(video_path.as_posix())
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+    if not shard_frames or n_frames <= shard_frames:
+        return [
+            Shard(video_path.as_posix(), _get_part_path(output_path, None),
+                  _get_part_path(results_path, None))
+        ]
+    shards = []
+    for index, start in enumerate(range(0, n_frames, shard_frames)):
+        # The frame count is only an estimate, so the last shard runs to
+        # the end of the video.
+        end = start + shard_frames
+        shards.append(
+            Shard(video_path.as_posix(), _get_part_path(output_path, index),
+                  _get_part_path(results_path, index), start,
+                  end if end < n_frames else None))
+    return shards
+
+
+def _concat_videos_ffmpeg(paths: List[str], output_path: pathlib.Path) -> bool:
+    """Concatenate the videos without re-encoding with the ffmpeg concat
+    demuxer. Returns False if ffmpeg isn't available or fails."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                     delete=False) as list_file:
+        for path in paths:
+            escaped = pathlib.Path(path).resolve().as_posix().replace(
+                "'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    command = [
+        ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-f', 'concat',
+        '-safe', '0', '-i', list_file.name, '-c', 'copy',
+        output_path.as_posix()
+    ]
+    try:
+        subprocess.run(command, check=True)
+    except subprocess.CalledProcessError:
+        logger.warning('ffmpeg failed to concatenate the shards of '
+                       f'{output_path}, re-encoding them instead')
+        return False
+    finally:
+        pathlib.Path(list_file.name).unlink()
+    return True
+
+
+def _concat_videos_opencv(paths: List[str], output_path: pathlib.Path) -> None:
+    """Concatenate the videos by decoding and encoding them again."""
+    cap = cv2.VideoCapture(paths[0])
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    writer = cv2.VideoWriter(
+        output_path.as_posix(),
+        cv2.VideoWriter_fourcc(*FOURCCS[output_path.suffix[1:]]), fps, size)
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            writer.write(frame)
+        cap.release()
+    writer.release()
+
+
+def merge_shards(shards: List[Shard], output_path: Optional[pathlib.Path],
+                 results_path: Optional[pathlib.Path]) -> None:
+    """Concatenate the outputs of the shards and delete them.
+
+    The overlay videos are concatenated without re-encoding if ffmpeg is
+    installed. Otherwise, they are decoded and encoded again, which runs on
+    a single core after the shards and re-compresses the frames.
+    """
+    if len(shards) == 1:
+        return
+    if results_path:
+        merge_results([shard.results_path for shard in shards],
+                      results_path.as_posix())
+    if not output_path:
+        return
+    paths = [shard.output_path for shard in shards]
+    if not _concat_videos_ffmpeg(paths, output_path):
+        _concat_videos_opencv(paths, output_path)
+    for path in paths:
+        pathlib.Path(path).unlink()
+
+
+# The processor of a worker process, which is created once per process
+_processor: Optional[BatchProcessor] = None
+
+
+def _init_worker(config: dict, n_workers: int, queue_size: int,
+                 n_threads: int) -> None:
+    global _processor
+    torch.set_num_threads(n_threads)
+    _processor = BatchProcessor(OmegaConf.create(config), n_workers,
+                                queue_size)
+
+
+def _process_shard(shard: Shard) -> Tuple[int, Dict[str, float]]:
+    """Returns the number of frames and the busy time of each stage."""
+    stage_times = dict(_processor.stage_times)
+    n_frames = _processor.process(shard.video_path, shard.output_path,
+                                  shard.results_path, shard.start_frame,
+                                  shard.end_frame)
+    return n_frames, {
+        stage: busy_time - stage_times.get(stage, 0.)
+        for stage, busy_time in _processor.stage_times.items()
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    video_paths = find_videos(args.videos)
+    config = load_config(args, video_paths)
+    output_dir = pathlib.Path(config.demo.output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    if args.no_overlay and not args.results_format:
+        raise ValueError('--no-overlay needs --results-format.')
+    ext = config.demo.output_file_extension
+    shard_frames = args.shard_frames if args.processes > 1 else None
+    videos = []
+    for video_path in video_paths:
+        output_path = None
+        if not args.no_overlay:
+            output_path = output_dir / f'{video_path.stem}.{ext}'
+        results_path = None
+        if args.results_format:
+            results_path = resolve_results_path(
+                output_dir / f'{video_path.stem}.{args.results_format}')
+        videos.append((video_path, output_path, results_path,
+                       split_video(video_path, output_path, results_path,
+                                   shard_frames)))
+    shards = [shard for *_, video_shards in videos for shard in video_shards]
+
+    n_threads = max(1, torch.get_num_threads() // args.processes)
+    init_args = (OmegaConf.to_container(config), args.workers, args.queue_size,
+                 n_threads)
+    start = time.perf_counter()
+    if args.processes == 1:
+        _init_worker(*init_args)
+        results = list(map(_process_shard, shards))
+    else:
+        # Spawn the workers, as forking a process that has loaded
+        # PyTorch and OpenCV isn't safe.
+        with concurrent.futures.ProcessPoolExecutor(
+                args.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=init_args) as executor:
+            results = list(executor.map(_process_shard, shards))
+
+    n_frames = collections.Counter()
+    stage_times = collections.Counter()
+    for shard, (shard_frames, shard_stage_times) in zip(shards, results):
+        n_frames[shard.video_path] += shard_frames
+        stage_times.update(shard_stage_times)
+    merge_start = time.perf_counter()
+    for video_path, output_path, results_path, video_shards in videos:
+        merge_shards(video_shards, output_path, results_path)
+        logger.info(f'Processed {n_frames[video_path.as_posix()]} frames of '
+                    f'{video_path}')
+    merge_time = time.perf_counter() - merge_start
+    # The throughput includes merging the outputs of the shards
+    elapsed = time.perf_counter() - start
+
+    total_frames = sum(n_frames.values())
+    message = (f'[batch] videos: {len(videos)}, frames: {total_frames}, '
+               f'{total_frames / elapsed:.1f} fps with {args.processes} '
+               f'processes, merge: {merge_time:.1f} s')
+    for stage, busy_time in stage_times.items():
+        # The busy fraction of the threads running the stage
+        n_stage_threads = args.processes
+        if stage == 'estimate':
+            n_stage_threads *= args.workers
+        message += (f', {stage} busy: '
+                    f'{busy_time / (elapsed * n_stage_threads) * 100:.0f}%')
+    logger.info(message)
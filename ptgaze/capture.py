@@ -0,0 +1,109 @@
+"""Reading the frames of a camera or a video on a background thread.
+
+``ThreadedCapture`` keeps a single slot with the latest frame. When the
+frames come faster than they are processed, e.g. from a camera, an unread
+frame in the slot is replaced by the next one and counted as dropped, so
+the caller always gets the freshest frame and the latency doesn't grow.
+Without dropping, e.g. for video files, the reader waits until the slot is
+taken, which only overlaps the decoding with the processing.
+"""
+import dataclasses
+import logging
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass()
+class CapturedFrame:
+    # The index of the frame among all the frames read from the source,
+    # including the dropped ones
+    index: int
+    # Seconds since the epoch for live sources, and the position in the
+    # video otherwise
+    timestamp: float
+    image: np.ndarray
+
+
+class ThreadedCapture:
+    def __init__(self,
+                 cap: cv2.VideoCapture,
+                 live: bool,
+                 drop_frames: Optional[bool] = None):
+        """Wrap an opened capture.
+
+        ``live`` tells whether the source is a camera, whose timestamps are
+        taken when the frames are read. ``drop_frames`` defaults to
+        ``live``. The reader thread starts on the first ``read``.
+        """
+        self._cap = cap
+        self.live = live
+        self.drop_frames = live if drop_frames is None else drop_frames
+
+        self._condition = threading.Condition()
+        self._frame: Optional[CapturedFrame] = None
+        self._finished = False
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.n_read = 0
+        self.n_dropped = 0
+
+    def is_opened(self) -> bool:
+        return self._cap.isOpened()
+
+    def get(self, prop_id: int) -> float:
+        """Same as cv2.VideoCapture.get, e.g. for the size or the FPS."""
+        return self._cap.get(prop_id)
+
+    def read(self) -> Optional[CapturedFrame]:
+        """Take the latest frame, waiting for it if there's none yet.
+
+        Returns None when the source has no more frames.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read_frames,
+                                            name='capture',
+                                            daemon=True)
+            self._thread.start()
+        with self._condition:
+            while self._frame is None and not self._finished:
+                self._condition.wait()
+            frame = self._frame
+            self._frame = None
+            self._condition.notify_all()
+        return frame
+
+    def release(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._cap.release()
+
+    def _read_frames(self) -> None:
+        while True:
+            ok, image = self._cap.read()
+            if self.live:
+                timestamp = time.time()
+            else:
+                timestamp = self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            with self._condition:
+                if not self.drop_frames:
+                    while self._frame is not None and not self._stopped:
+                        self._condition.wait()
+                if not ok or self._stopped:
+                    self._finished = True
+                    self._condition.notify_all()
+                    return
+                if self._frame is not None:
+                    self.n_dropped += 1
+                self._frame = CapturedFrame(self.n_read, timestamp, image)
+                self.n_read += 1
+                self._condition.notify_all()
@@ -1,10 +1,13 @@
+import copy
 import dataclasses
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 import cv2
 import numpy as np
 import yaml
 
+RemapMaps = Tuple[np.ndarray, np.ndarray]
+
 
 @dataclasses.dataclass()
 class Camera:
@@ -12,6 +15,12 @@ class Camera:
     height: int = dataclasses.field(init=False)
     camera_matrix: np.ndarray = dataclasses.field(init=False)
     dist_coefficients: np.ndarray = dataclasses.field(init=False)
+    # The cv2.remap maps of undistort for each image size
+    _undistort_maps: Dict[Tuple[int, int],
+                          RemapMaps] = dataclasses.field(init=False,
+                                                         default_factory=dict,
+                                                         repr=False,
+                                                         compare=False)
 
     camera_params_path: dataclasses.InitVar[str] = None
 
@@ -38,3 +47,47 @@ class Camera:
                                         self.camera_matrix,
                                         self.dist_coefficients)
         return points2d.reshape(-1, 2)
+
+    def resized(self, width: int, height: int) -> 'Camera':
+        """Return the camera whose images are resized to (width, height).
+
+        The intrinsics are scaled with the same pixel-center alignment as
+        cv2.resize, so the warped image covers the same view as warping with
+        this camera and then resizing. The pixels are only equal up to the
+        interpolation: when downscaling, the warp samples the source without
+        the area filtering of cv2.resize. With the packaged configs, the
+        normalized cameras already have the model input size, so resizing
+        them changes nothing.
+        """
+        camera = copy.copy(self)
+        scale = np.array([width / self.width, height / self.height])
+        camera_matrix = self.camera_matrix.copy()
+        camera_matrix[:2] *= scale[:, None]
+        camera_matrix[:2, 2] += (scale - 1) / 2
+        camera.camera_matrix = camera_matrix
+        camera.width = width
+        camera.height = height
+        camera._undistort_maps = {}
+        return camera
+
+    def undistort(self,
+                  image: np.ndarray,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Same as cv2.undistort, but the maps are computed only once.
+
+        The result is written to ``out`` if it has the shape and type of
+        ``image``, which lets callers reuse the output buffer. If there's
+        no distortion, ``image`` itself is returned.
+        """
+        if not self.dist_coefficients.any():
+            return image
+        size = (image.shape[1], image.shape[0])
+        maps = self._undistort_maps.get(size)
+        if maps is None:
+            # cv2.undistort computes the same fixed-point maps internally.
+            maps = cv2.initUndistortRectifyMap(self.camera_matrix,
+                                               self.dist_coefficients, None,
+                                               self.camera_matrix, size,
+                                               cv2.CV_16SC2)
+            self._undistort_maps[size] = maps
+        return cv2.remap(image, *maps, cv2.INTER_LINEAR, dst=out)
@@ -11,6 +11,8 @@ class Face(FaceParts):
         super().__init__(FacePartsName.FACE)
         self.bbox = bbox
         self.landmarks = landmarks
+        # Set when the face is tracked over video frames
+        self.face_id: Optional[int] = None
 
         self.reye: Eye = Eye(FacePartsName.REYE)
         self.leye: Eye = Eye(FacePartsName.LEYE)
@@ -1,4 +1,5 @@
 import dataclasses
+from typing import Dict
 
 import cv2
 import numpy as np
@@ -15,8 +16,35 @@ class FaceModel:
     LEYE_INDICES: np.ndarray
     MOUTH_INDICES: np.ndarray
     NOSE_INDICES: np.ndarray
+    # Landmarks that hardly move with facial expressions, which are
+    # enough to fit the head pose.
+    STABLE_INDICES: np.ndarray
     CHIN_INDEX: int
     NOSE_INDEX: int
+    # The face center for each mode and the eye centers of the template
+    # model, stacked in this order. See compute_face_eye_centers.
+    _centers: Dict[str, np.ndarray] = dataclasses.field(init=False,
+                                                        repr=False,
+                                                        compare=False)
+
+    def __post_init__(self):
+        # The centers move rigidly with the head, so the points are
+        # averaged once on the template model instead of for every face.
+        reye_center = self.LANDMARKS[self.REYE_INDICES].mean(axis=0)
+        leye_center = self.LANDMARKS[self.LEYE_INDICES].mean(axis=0)
+        face_indices = {
+            'MPIIGaze': self.MOUTH_INDICES,
+            'MPIIFaceGaze': self.MOUTH_INDICES,
+            'ETH-XGaze': self.NOSE_INDICES,
+        }
+        centers = {}
+        for mode, indices in face_indices.items():
+            indices = np.concatenate(
+                [self.REYE_INDICES, self.LEYE_INDICES, indices])
+            face_center = self.LANDMARKS[indices].mean(axis=0)
+            centers[mode] = np.vstack([face_center, reye_center, leye_center])
+        # The dataclass is frozen.
+        object.__setattr__(self, '_centers', centers)
 
     def estimate_head_pose(self, face: Face, camera: Camera) -> None:
         """Estimate the head pose by fitting 3D template model."""
@@ -56,14 +84,10 @@ class FaceModel:
         the average coordinates of the six points at the corners of both
         eyes and the nose. The eye centers are defined as the average
         coordinates of the corners of each eye.
+
+        Only the precomputed centers of the template model are
+        transformed, so this doesn't need ``compute_3d_pose``.
         """
-        if mode == 'ETH-XGaze':
-            face.center = face.model3d[np.concatenate(
-                [self.REYE_INDICES, self.LEYE_INDICES,
-                 self.NOSE_INDICES])].mean(axis=0)
-        else:
-            face.center = face.model3d[np.concatenate(
-                [self.REYE_INDICES, self.LEYE_INDICES,
-                 self.MOUTH_INDICES])].mean(axis=0)
-        face.reye.center = face.model3d[self.REYE_INDICES].mean(axis=0)
-        face.leye.center = face.model3d[self.LEYE_INDICES].mean(axis=0)
+        rot = face.head_pose_rot.as_matrix()
+        centers = self._centers[mode] @ rot.T + face.head_position
+        face.center, face.reye.center, face.leye.center = centers
@@ -100,6 +100,9 @@ class FaceModel68(FaceModel):
     LEYE_INDICES: np.ndarray = np.array([42, 45])
     MOUTH_INDICES: np.ndarray = np.array([48, 54])
     NOSE_INDICES: np.ndarray = np.array([31, 35])
+    # The upper face contour, the nose and the eye corners
+    STABLE_INDICES: np.ndarray = np.array(
+        [0, 1, 15, 16, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 39, 42, 45])
 
     CHIN_INDEX: int = 8
     NOSE_INDEX: int = 30
@@ -500,6 +500,13 @@ class FaceModelMediaPipe(FaceModel):
     LEYE_INDICES: np.ndarray = np.array([362, 263])
     MOUTH_INDICES: np.ndarray = np.array([78, 308])
     NOSE_INDICES: np.ndarray = np.array([240, 460])
+    # The landmarks of the Procrustes landmark basis of the MediaPipe
+    # face geometry module
+    STABLE_INDICES: np.ndarray = np.array([
+        4, 6, 10, 33, 54, 67, 117, 119, 121, 127, 129, 132, 133, 136, 143, 147,
+        198, 205, 263, 284, 297, 346, 348, 350, 356, 358, 361, 362, 365, 372,
+        376, 420, 425
+    ])
 
     CHIN_INDEX: int = 199
     NOSE_INDEX: int = 1
@@ -1,15 +1,18 @@
 import datetime
 import logging
 import pathlib
-from typing import Optional
+from typing import List, Optional
 
 import cv2
 import numpy as np
 from omegaconf import DictConfig
 
+from .capture import ThreadedCapture
 from .common import Face, FacePartsName, Visualizer
 from .gaze_estimator import GazeEstimator
+from .results import ResultsWriter, create_results_writer
 from .utils import get_3d_face_model
+from .video_writer import FOURCCS, AsyncVideoWriter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,13 +24,21 @@ class Demo:
     def __init__(self, config: DictConfig):
         self.config = config
         self.gaze_estimator = GazeEstimator(config)
-        face_model_3d = get_3d_face_model(config)
+        self._face_model3d = get_3d_face_model(config)
         self.visualizer = Visualizer(self.gaze_estimator.camera,
-                                     face_model_3d.NOSE_INDEX)
+                                     self._face_model3d.NOSE_INDEX)
 
         self.cap = self._create_capture()
         self.output_dir = self._create_output_dir()
         self.writer = self._create_video_writer()
+        # Reused for the undistorted frames
+        self._undistorted: Optional[np.ndarray] = None
+        self.results_writer = self._create_results_writer()
+        # The overlay isn't drawn if it's neither shown nor saved, and the
+        # results file replaces the logs written while drawing.
+        self._draw_overlay = (self.config.demo.display_on_screen
+                              or self.output_dir is not None
+                              or self.results_writer is None)
 
         self.stop = False
         self.show_bbox = self.config.demo.show_bbox
@@ -59,6 +70,9 @@ class Demo:
             name = pathlib.Path(self.config.demo.image_path).name
             output_path = pathlib.Path(self.config.demo.output_dir) / name
             cv2.imwrite(output_path.as_posix(), self.visualizer.image)
+        if self.results_writer:
+            self.results_writer.close()
+        self.gaze_estimator.timer.log_summary(logger)
 
     def _run_on_video(self) -> None:
         while True:
@@ -67,26 +81,68 @@ class Demo:
                 if self.stop:
                     break
 
-            ok, frame = self.cap.read()
-            if not ok:
+            frame = self.cap.read()
+            if frame is None:
                 break
-            self._process_image(frame)
+            self._process_image(frame.image, frame.index, frame.timestamp)
 
             if self.config.demo.display_on_screen:
                 cv2.imshow('frame', self.visualizer.image)
         self.cap.release()
         if self.writer:
             self.writer.release()
+            self.writer.log_stats()
+        if self.results_writer:
+            self.results_writer.close()
+        self._log_capture_stats()
+        self._log_head_pose_stats()
+        self.gaze_estimator.timer.log_summary(logger)
 
-    def _process_image(self, image) -> None:
-        undistorted = cv2.undistort(
-            image, self.gaze_estimator.camera.camera_matrix,
-            self.gaze_estimator.camera.dist_coefficients)
+    def _log_capture_stats(self) -> None:
+        if self.cap.n_read == 0:
+            return
+        logger.info(f'[capture] frames: {self.cap.n_read}, '
+                    f'dropped: {self.cap.n_dropped} '
+                    f'({self.cap.n_dropped / self.cap.n_read:.1%})')
+
+    def _log_head_pose_stats(self) -> None:
+        estimator = self.gaze_estimator.head_pose_estimator
+        if estimator.total_faces == 0:
+            return
+        message = (f'[head pose] faces: {estimator.total_faces}, '
+                   f'warm-started: {estimator.total_warm_starts}, '
+                   f'{estimator.total_time / estimator.total_faces * 1000:.3f}'
+                   ' ms/face')
+        if estimator.solver == 'batched':
+            iterations = estimator.total_iterations / estimator.total_faces
+            message += f', {iterations:.2f} iterations/face'
+        logger.info(message)
+
+    def _process_image(self,
+                       image: np.ndarray,
+                       frame_index: int = 0,
+                       timestamp: float = 0.) -> None:
+        timer = self.gaze_estimator.timer
+        with timer.frame():
+            undistorted = self.gaze_estimator.undistort(image,
+                                                        out=self._undistorted)
+            if undistorted is not image:
+                self._undistorted = undistorted
 
+            if self.cap is not None:
+                faces = self.gaze_estimator.track_faces(undistorted)
+            else:
+                faces = self.gaze_estimator.detect_faces(undistorted)
+            self.gaze_estimator.estimate_gaze_batch(undistorted, faces)
+            if self.results_writer:
+                self.results_writer.add(frame_index, timestamp, faces)
+            if self._draw_overlay:
+                with timer.measure('drawing'):
+                    self._draw_faces(image, faces)
+
+    def _draw_faces(self, image: np.ndarray, faces: List[Face]) -> None:
         self.visualizer.set_image(image.copy())
-        faces = self.gaze_estimator.detect_faces(undistorted)
         for face in faces:
-            self.gaze_estimator.estimate_gaze(undistorted, face)
             self._draw_face_bbox(face)
             self._draw_head_pose(face)
             self._draw_landmarks(face)
@@ -99,7 +155,7 @@ class Demo:
         if self.writer:
             self.writer.write(self.visualizer.image)
 
-    def _create_capture(self) -> Optional[cv2.VideoCapture]:
+    def _create_capture(self) -> Optional[ThreadedCapture]:
         if self.config.demo.image_path:
             return None
         if self.config.demo.use_camera:
@@ -110,7 +166,11 @@ class Demo:
             raise ValueError
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.gaze_estimator.camera.width)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.gaze_estimator.camera.height)
-        return cap
+        # The frames of video files are never dropped.
+        return ThreadedCapture(cap,
+                               live=self.config.demo.use_camera,
+                               drop_frames=self.config.demo.use_camera
+                               and self.config.demo.drop_frames)
 
     def _create_output_dir(self) -> Optional[pathlib.Path]:
         if not self.config.demo.output_dir:
@@ -124,18 +184,15 @@ class Demo:
         dt = datetime.datetime.now()
         return dt.strftime('%Y%m%d_%H%M%S')
 
-    def _create_video_writer(self) -> Optional[cv2.VideoWriter]:
+    def _create_video_writer(self) -> Optional[AsyncVideoWriter]:
         if self.config.demo.image_path:
             return None
         if not self.output_dir:
             return None
         ext = self.config.demo.output_file_extension
-        if ext == 'mp4':
-            fourcc = cv2.VideoWriter_fourcc(*'H264')
-        elif ext == 'avi':
-            fourcc = cv2.VideoWriter_fourcc(*'PIM1')
-        else:
+        if ext not in FOURCCS:
             raise ValueError
+        fourcc = cv2.VideoWriter_fourcc(*FOURCCS[ext])
         if self.config.demo.use_camera:
             output_name = f'{self._create_timestamp()}.{ext}'
         elif self.config.demo.video_path:
@@ -144,12 +201,19 @@ class Demo:
         else:
             raise ValueError
         output_path = self.output_dir / output_name
-        writer = cv2.VideoWriter(output_path.as_posix(), fourcc, 30,
+        # The FPS of the source, if it's known
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        writer = cv2.VideoWriter(output_path.as_posix(), fourcc, fps,
                                  (self.gaze_estimator.camera.width,
                                   self.gaze_estimator.camera.height))
         if writer is None:
             raise RuntimeError
-        return writer
+        return AsyncVideoWriter(writer, self.config.demo.writer_queue_size)
+
+    def _create_results_writer(self) -> Optional[ResultsWriter]:
+        if not self.config.demo.results_path:
+            return None
+        return create_results_writer(self.config.demo.results_path)
 
     def _wait_key(self) -> bool:
         key = cv2.waitKey(self.config.demo.wait_time) & 0xff
@@ -196,6 +260,10 @@ class Demo:
     def _draw_face_template_model(self, face: Face) -> None:
         if not self.show_template_model:
             return
+        # The gaze estimation only needs the face and eye centers, so the
+        # whole template model is transformed only to be drawn.
+        if face.model3d is None:
+            self._face_model3d.compute_3d_pose(face)
         self.visualizer.draw_3d_points(face.model3d,
                                        color=(255, 0, 525),
                                        size=1)
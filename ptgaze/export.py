@@ -0,0 +1,172 @@
+"""Export the gaze estimation models.
+
+The exported models are loaded by GazeEstimator when
+``gaze_estimator.inference_backend`` is set to the export format, e.g.
+
+    ptgaze export --mode eth-xgaze --format torchscript
+
+TorchScript models load the fastest, but TorchScript is deprecated in
+recent PyTorch versions, so the models can also be exported with
+torch.export. The ``onnxruntime`` format exports the models to ONNX, which
+needs the onnx and onnxscript packages, and onnxruntime to run them.
+"""
+import argparse
+import logging
+import pathlib
+from typing import List, Optional, Tuple
+
+import torch
+from omegaconf import DictConfig
+
+from .common import Camera
+from .models import load_model
+from .utils import (EXPORTED_MODEL_SUFFIXES, download_gaze_model,
+                    expanduser_all, get_exported_model_path,
+                    load_config_file, load_packaged_config)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='ptgaze export')
+    parser.add_argument('--config', type=str, help='Config file.')
+    parser.add_argument('--mode',
+                        type=str,
+                        choices=['mpiigaze', 'mpiifacegaze', 'eth-xgaze'])
+    parser.add_argument('--format',
+                        type=str,
+                        default='torchscript',
+                        choices=sorted(EXPORTED_MODEL_SUFFIXES))
+    parser.add_argument('--device',
+                        type=str,
+                        choices=['cpu', 'cuda'],
+                        help='Device the exported model runs on.')
+    parser.add_argument(
+        '--output',
+        '-o',
+        type=str,
+        help='Output path. By default, the path from which GazeEstimator '
+        'loads the model, i.e. the checkpoint path with the suffix of the '
+        'format.')
+    return parser.parse_args(argv)
+
+
+def load_config(args: argparse.Namespace) -> DictConfig:
+    if args.config:
+        config = load_config_file(args.config)
+    elif args.mode:
+        config = load_packaged_config(args.mode)
+        download_gaze_model(config)
+    else:
+        raise ValueError(
+            'You need to specify one of \'--mode\' or \'--config\'.')
+    if args.device:
+        config.device = args.device
+    config.gaze_estimator.inference_backend = args.format
+    if args.output:
+        config.gaze_estimator.exported_model = args.output
+    expanduser_all(config)
+    return config
+
+
+def create_example_inputs(config: DictConfig,
+                          batch_size: int) -> Tuple[torch.Tensor, ...]:
+    device = torch.device(config.device)
+    if config.mode == 'MPIIGaze':
+        camera = Camera(config.gaze_estimator.normalized_camera_params)
+        images = torch.rand(batch_size, 1, camera.height, camera.width)
+        head_poses = torch.rand(batch_size, 2)
+        return images.to(device), head_poses.to(device)
+    elif config.mode in ['MPIIFaceGaze', 'ETH-XGaze']:
+        width, height = config.gaze_estimator.image_size
+        images = torch.rand(batch_size, 3, height, width)
+        return images.to(device),
+    else:
+        raise ValueError
+
+
+@torch.no_grad()
+def export_torchscript(config: DictConfig, output_path: pathlib.Path) -> None:
+    """Trace the model, freeze it and save it to ``output_path``.
+
+    Freezing inlines the weights and folds the batch normalization into
+    the convolutions. The batch size stays dynamic.
+    """
+    model = load_model(config)
+    traced = torch.jit.trace(model, create_example_inputs(config, 2))
+    frozen = torch.jit.freeze(traced)
+
+    inputs = create_example_inputs(config, 5)
+    error = (frozen(*inputs) - model(*inputs)).abs().max().item()
+    logger.info(f'Max abs difference from the eager model: {error:.2e}')
+
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    frozen.save(output_path.as_posix())
+
+
+@torch.no_grad()
+def export_torch_export(config: DictConfig, output_path: pathlib.Path) -> None:
+    """Export the model with torch.export and save it to ``output_path``."""
+    model = load_model(config)
+    inputs = create_example_inputs(config, 2)
+    batch = torch.export.Dim('batch', min=1, max=1024)
+    program = torch.export.export(model,
+                                  inputs,
+                                  dynamic_shapes=tuple({0: batch}
+                                                       for _ in inputs))
+
+    inputs = create_example_inputs(config, 5)
+    error = (program.module()(*inputs) - model(*inputs)).abs().max().item()
+    logger.info(f'Max abs difference from the eager model: {error:.2e}')
+
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    torch.export.save(program, output_path.as_posix())
+
+
+@torch.no_grad()
+def export_onnx(config: DictConfig,
+                output_path: pathlib.Path,
+                model: Optional[torch.nn.Module] = None) -> None:
+    """Export the model to ONNX and save it to ``output_path``.
+
+    The inputs are named ``images`` and, for MPIIGaze, ``head_poses``,
+    and the output is named ``gaze``. ``model`` defaults to the model
+    with the weights of the checkpoint.
+    """
+    from .models.onnxruntime_model import OnnxRuntimeModel
+
+    if model is None:
+        model = load_model(config)
+    inputs = create_example_inputs(config, 2)
+    input_names = ['images', 'head_poses'][:len(inputs)]
+    batch = torch.export.Dim('batch', min=1, max=1024)
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    torch.onnx.export(model,
+                      inputs,
+                      output_path.as_posix(),
+                      input_names=input_names,
+                      output_names=['gaze'],
+                      dynamic_shapes=tuple({0: batch} for _ in inputs),
+                      dynamo=True)
+
+    session = OnnxRuntimeModel(output_path.as_posix(), torch.device('cpu'))
+    inputs = create_example_inputs(config, 5)
+    outputs = session(*inputs)
+    error = (outputs - model(*inputs).cpu()).abs().max().item()
+    logger.info(f'Max abs difference from the eager model: {error:.2e}')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    config = load_config(args)
+    output_path = get_exported_model_path(config)
+    if args.format == 'torchscript':
+        export_torchscript(config, output_path)
+    elif args.format == 'torch_export':
+        export_torch_export(config, output_path)
+    elif args.format == 'onnxruntime':
+        export_onnx(config, output_path)
+    else:
+        raise ValueError
+    logger.info(f'Exported the {config.mode} model to {output_path}')
@@ -1,14 +1,16 @@
 import logging
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 import torch
 from omegaconf import DictConfig
 
 from .common import Camera, Face, FacePartsName
-from .head_pose_estimation import HeadPoseNormalizer, LandmarkEstimator
-from .models import create_model
-from .transforms import create_transform
+from .head_pose_estimation import (FaceTracker, HeadPoseEstimator,
+                                   HeadPoseNormalizer, LandmarkEstimator)
+from .models import load_inference_model
+from .timing import StageTimer
+from .transforms import create_batch_transform, create_transform
 from .utils import get_3d_face_model
 
 logger = logging.getLogger(__name__)
@@ -17,7 +19,14 @@ logger = logging.getLogger(__name__)
 class GazeEstimator:
     EYE_KEYS = [FacePartsName.REYE, FacePartsName.LEYE]
 
-    def __init__(self, config: DictConfig):
+    def __init__(self,
+                 config: DictConfig,
+                 load_model: bool = True,
+                 detect_faces: bool = True):
+        """With ``load_model=False``, the gaze estimation model isn't loaded
+        and the estimator only detects and normalizes the faces. With
+        ``detect_faces=False``, the landmark detector isn't created and the
+        estimator only runs ``predict_gaze`` on faces detected elsewhere."""
         self._config = config
 
         self._face_model3d = get_3d_face_model(config)
@@ -25,99 +34,206 @@ class GazeEstimator:
         self.camera = Camera(config.gaze_estimator.camera_params)
         self._normalized_camera = Camera(
             config.gaze_estimator.normalized_camera_params)
-
-        self._landmark_estimator = LandmarkEstimator(config)
+        self._batch_transform = None
+        if config.gaze_estimator.fused_preprocessing:
+            # Warp directly to the model input size, so that the normalized
+            # images don't need to be resized before the forward pass.
+            if config.mode != 'MPIIGaze':
+                self._normalized_camera = self._normalized_camera.resized(
+                    *config.gaze_estimator.image_size)
+            self._batch_transform = create_batch_transform(
+                config, (self._normalized_camera.width,
+                         self._normalized_camera.height))
+
+        self._landmark_estimator = None
+        self._face_tracker = None
+        if detect_faces:
+            self._landmark_estimator = LandmarkEstimator(config)
+        if detect_faces and config.face_detector.track_faces:
+            self._face_tracker = FaceTracker(self._landmark_estimator, config)
+        self.head_pose_estimator = HeadPoseEstimator(self._face_model3d,
+                                                     self.camera, config)
         self._head_pose_normalizer = HeadPoseNormalizer(
             self.camera, self._normalized_camera,
-            self._config.gaze_estimator.normalized_camera_distance)
-        self._gaze_estimation_model = self._load_model()
+            self._config.gaze_estimator.normalized_camera_distance,
+            config.gaze_estimator.undistort_points)
+        self._gaze_estimation_model = None
+        if load_model:
+            self._gaze_estimation_model = load_inference_model(config)
         self._transform = create_transform(config)
+        # The latencies of the stages, see ptgaze.timing
+        self.timer = StageTimer()
+
+    def set_camera(self, camera: Camera) -> None:
+        """Process the next frames, e.g. of another size, with ``camera``.
 
-    def _load_model(self) -> torch.nn.Module:
-        model = create_model(self._config)
-        checkpoint = torch.load(self._config.gaze_estimator.checkpoint,
-                                map_location='cpu')
-        model.load_state_dict(checkpoint['model'])
-        model.to(torch.device(self._config.device))
-        model.eval()
-        return model
+        The faces of the previous frames are forgotten.
+        """
+        self.camera = camera
+        self.head_pose_estimator = HeadPoseEstimator(self._face_model3d,
+                                                     camera, self._config)
+        self._head_pose_normalizer = HeadPoseNormalizer(
+            camera, self._normalized_camera,
+            self._config.gaze_estimator.normalized_camera_distance,
+            self._config.gaze_estimator.undistort_points)
+        if self._face_tracker is not None:
+            self._face_tracker.reset()
+
+    def undistort(self,
+                  image: np.ndarray,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Prepare a frame for ``detect_faces`` or ``track_faces``.
+
+        With ``gaze_estimator.undistort_points``, the faces are detected on
+        the raw frame, which is returned as is. The head pose estimator
+        removes the distortion from the landmarks, and the normalization
+        warp from the images, so the whole frame is never undistorted.
+        """
+        if self._config.gaze_estimator.undistort_points:
+            return image
+        with self.timer.measure('undistort'):
+            return self.camera.undistort(image, out=out)
 
     def detect_faces(self, image: np.ndarray) -> List[Face]:
-        return self._landmark_estimator.detect_faces(image)
+        if self._landmark_estimator is None:
+            raise RuntimeError(
+                'The estimator was created with detect_faces=False.')
+        with self.timer.measure('detection'):
+            return self._landmark_estimator.detect_faces(image)
+
+    def track_faces(self, image: np.ndarray) -> List[Face]:
+        """Detect faces in a frame of a video.
+
+        If face tracking is enabled, the full detection runs only
+        periodically and the faces keep their IDs across frames.
+        Otherwise, this is the same as ``detect_faces``.
+        """
+        if self._face_tracker is None:
+            return self.detect_faces(image)
+        with self.timer.measure('detection'):
+            return self._face_tracker.track(image)
+
+    def reset(self) -> None:
+        """Forget the faces of the previous frames, e.g. for a new video."""
+        if self._face_tracker is not None:
+            self._face_tracker.reset()
+        self.head_pose_estimator.reset()
 
     def estimate_gaze(self, image: np.ndarray, face: Face) -> None:
-        self._face_model3d.estimate_head_pose(face, self.camera)
-        self._face_model3d.compute_3d_pose(face)
-        self._face_model3d.compute_face_eye_centers(face, self._config.mode)
-
+        self.estimate_gaze_batch(image, [face])
+
+    def estimate_gaze_batch(self, image: np.ndarray,
+                            faces: List[Face]) -> None:
+        """Estimate the gaze of all the faces with a single forward pass."""
+        self.normalize_faces(image, faces)
+        self.predict_gaze(faces)
+
+    def normalize_faces(self, image: np.ndarray, faces: List[Face]) -> None:
+        """Estimate the head poses and compute the normalized images.
+
+        The normalized images are stored in the faces, so the faces can
+        be passed to ``predict_gaze`` later, possibly together with faces
+        taken from other images.
+        """
+        with self.timer.measure('head_pose'):
+            self.head_pose_estimator.estimate(faces)
+        with self.timer.measure('normalization'):
+            for face in faces:
+                self._face_model3d.compute_face_eye_centers(
+                    face, self._config.mode)
+
+            if self._config.mode == 'MPIIGaze':
+                eyes_or_faces = [
+                    getattr(face, key.name.lower()) for face in faces
+                    for key in self.EYE_KEYS
+                ]
+            elif self._config.mode in ['MPIIFaceGaze', 'ETH-XGaze']:
+                eyes_or_faces = faces
+            else:
+                raise ValueError
+            self._head_pose_normalizer.normalize_batch(image, eyes_or_faces)
+
+    def predict_gaze(self, faces: List[Face]) -> None:
+        """Run the gaze estimation model on already normalized faces."""
+        if not faces:
+            return
+        if self._gaze_estimation_model is None:
+            raise RuntimeError('The gaze estimation model is not loaded.')
         if self._config.mode == 'MPIIGaze':
-            for key in self.EYE_KEYS:
-                eye = getattr(face, key.name.lower())
-                self._head_pose_normalizer.normalize(image, eye)
-            self._run_mpiigaze_model(face)
+            self._run_mpiigaze_model(faces)
         elif self._config.mode == 'MPIIFaceGaze':
-            self._head_pose_normalizer.normalize(image, face)
-            self._run_mpiifacegaze_model(face)
+            self._run_mpiifacegaze_model(faces)
         elif self._config.mode == 'ETH-XGaze':
-            self._head_pose_normalizer.normalize(image, face)
-            self._run_ethxgaze_model(face)
+            self._run_ethxgaze_model(faces)
         else:
             raise ValueError
 
+    def _to_batch(self, images: List[np.ndarray]) -> torch.Tensor:
+        """Convert normalized images into a model input batch."""
+        with self.timer.measure('preprocessing'):
+            if self._batch_transform is not None:
+                return self._batch_transform(images)
+            images = torch.stack([
+                self._transform(np.ascontiguousarray(image))
+                for image in images
+            ])
+            return images.to(torch.device(self._config.device))
+
     @torch.no_grad()
-    def _run_mpiigaze_model(self, face: Face) -> None:
+    def _run_mpiigaze_model(self, faces: List[Face]) -> None:
         images = []
         head_poses = []
-        for key in self.EYE_KEYS:
-            eye = getattr(face, key.name.lower())
-            image = eye.normalized_image
-            normalized_head_pose = eye.normalized_head_rot2d
-            if key == FacePartsName.REYE:
-                image = image[:, ::-1].copy()
-                normalized_head_pose *= np.array([1, -1])
-            image = self._transform(image)
-            images.append(image)
-            head_poses.append(normalized_head_pose)
-        images = torch.stack(images)
+        for face in faces:
+            for key in self.EYE_KEYS:
+                eye = getattr(face, key.name.lower())
+                image = eye.normalized_image
+                normalized_head_pose = eye.normalized_head_rot2d
+                if key == FacePartsName.REYE:
+                    image = image[:, ::-1]
+                    normalized_head_pose = normalized_head_pose * np.array(
+                        [1, -1])
+                images.append(image)
+                head_poses.append(normalized_head_pose)
+        images = self._to_batch(images)
         head_poses = np.array(head_poses).astype(np.float32)
         head_poses = torch.from_numpy(head_poses)
 
         device = torch.device(self._config.device)
-        images = images.to(device)
         head_poses = head_poses.to(device)
-        predictions = self._gaze_estimation_model(images, head_poses)
-        predictions = predictions.cpu().numpy()
+        with self.timer.measure('inference'):
+            predictions = self._gaze_estimation_model(images, head_poses)
+            predictions = predictions.cpu().numpy()
 
-        for i, key in enumerate(self.EYE_KEYS):
-            eye = getattr(face, key.name.lower())
-            eye.normalized_gaze_angles = predictions[i]
-            if key == FacePartsName.REYE:
-                eye.normalized_gaze_angles *= np.array([1, -1])
-            eye.angle_to_vector()
-            eye.denormalize_gaze_vector()
+        predictions = predictions.reshape(len(faces), len(self.EYE_KEYS), 2)
+        for face, face_predictions in zip(faces, predictions):
+            for key, prediction in zip(self.EYE_KEYS, face_predictions):
+                eye = getattr(face, key.name.lower())
+                eye.normalized_gaze_angles = prediction
+                if key == FacePartsName.REYE:
+                    eye.normalized_gaze_angles *= np.array([1, -1])
+                eye.angle_to_vector()
+                eye.denormalize_gaze_vector()
 
     @torch.no_grad()
-    def _run_mpiifacegaze_model(self, face: Face) -> None:
-        image = self._transform(face.normalized_image).unsqueeze(0)
-
-        device = torch.device(self._config.device)
-        image = image.to(device)
-        prediction = self._gaze_estimation_model(image)
-        prediction = prediction.cpu().numpy()
+    def _run_mpiifacegaze_model(self, faces: List[Face]) -> None:
+        images = self._to_batch([face.normalized_image for face in faces])
+        with self.timer.measure('inference'):
+            predictions = self._gaze_estimation_model(images)
+            predictions = predictions.cpu().numpy()
 
-        face.normalized_gaze_angles = prediction[0]
-        face.angle_to_vector()
-        face.denormalize_gaze_vector()
+        for face, prediction in zip(faces, predictions):
+            face.normalized_gaze_angles = prediction
+            face.angle_to_vector()
+            face.denormalize_gaze_vector()
 
     @torch.no_grad()
-    def _run_ethxgaze_model(self, face: Face) -> None:
-        image = self._transform(face.normalized_image).unsqueeze(0)
-
-        device = torch.device(self._config.device)
-        image = image.to(device)
-        prediction = self._gaze_estimation_model(image)
-        prediction = prediction.cpu().numpy()
-
-        face.normalized_gaze_angles = prediction[0]
-        face.angle_to_vector()
-        face.denormalize_gaze_vector()
+    def _run_ethxgaze_model(self, faces: List[Face]) -> None:
+        images = self._to_batch([face.normalized_image for face in faces])
+        with self.timer.measure('inference'):
+            predictions = self._gaze_estimation_model(images)
+            predictions = predictions.cpu().numpy()
+
+        for face, prediction in zip(faces, predictions):
+            face.normalized_gaze_angles = prediction
+            face.angle_to_vector()
+            face.denormalize_gaze_vector()
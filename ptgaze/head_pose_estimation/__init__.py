@@ -1,2 +1,4 @@
 from .face_landmark_estimator import LandmarkEstimator
+from .face_tracker import FaceTracker
+from .head_pose_estimator import HeadPoseEstimator
 from .head_pose_normalizer import HeadPoseNormalizer
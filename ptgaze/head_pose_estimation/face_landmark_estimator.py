@@ -1,5 +1,6 @@
-from typing import List
+from typing import List, Optional, Tuple
 
+import cv2
 import dlib
 import face_alignment
 import face_alignment.detection.sfd
@@ -9,10 +10,63 @@ from omegaconf import DictConfig
 
 from ..common import Face
 
+# Serialized layout of each landmark of a NormalizedLandmarkList when only
+# x, y and z are set, which is the case for face mesh: the tag and size of
+# the landmark message, followed by the tag and value of each field.
+_LANDMARK_WIRE_DTYPE = np.dtype([('header', 'u1', 3), ('x', '<f4'),
+                                 ('y_tag', 'u1'), ('y', '<f4'),
+                                 ('z_tag', 'u1'), ('z', '<f4')])
+_LANDMARK_WIRE_TAGS = np.array([0x0a, 0x0f, 0x0d, 0x15, 0x1d], dtype=np.uint8)
+
+
+def _landmarks_to_array(landmark_list, width: int, height: int) -> np.ndarray:
+    """Convert normalized mediapipe landmarks to pixel coordinates.
+
+    Instead of reading the landmarks one protobuf field at a time, the
+    serialized message is reinterpreted as a NumPy structured array,
+    which converts all the landmarks at once. Messages with a different
+    layout fall back to the per-landmark conversion.
+    """
+    data = landmark_list.SerializeToString()
+    n_points = len(data) // _LANDMARK_WIRE_DTYPE.itemsize
+    if n_points * _LANDMARK_WIRE_DTYPE.itemsize == len(data):
+        wire = np.frombuffer(data, dtype=_LANDMARK_WIRE_DTYPE)
+        tags = np.column_stack([wire['header'], wire['y_tag'], wire['z_tag']])
+        if (tags == _LANDMARK_WIRE_TAGS).all():
+            pts = np.empty((n_points, 2), dtype=np.float64)
+            pts[:, 0] = wire['x']
+            pts[:, 1] = wire['y']
+            pts *= (width, height)
+            return pts
+    return np.array([(pt.x * width, pt.y * height)
+                     for pt in landmark_list.landmark],
+                    dtype=np.float64)
+
+
+def _bgr_to_rgb(image: np.ndarray,
+                out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Convert a BGR image to RGB, writing into ``out`` if it fits."""
+    if out is None or out.shape != image.shape or out.dtype != image.dtype:
+        out = np.empty(image.shape, dtype=image.dtype)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=out)
+
 
 class LandmarkEstimator:
+    # Margin added around the detected face on each side, relative to the
+    # face size, when cropping the landmark ROI in the two-stage mode.
+    ROI_MARGIN = 0.25
+
     def __init__(self, config: DictConfig):
         self.mode = config.face_detector.mode
+        self.roi_detection = config.face_detector.roi_detection
+        self.roi_detection_scale = config.face_detector.roi_detection_scale
+        self._rgb_buffer: Optional[np.ndarray] = None
+        if self.roi_detection and self.mode == 'mediapipe':
+            # Face mesh already finds the faces on a downscaled frame and
+            # runs the landmark model on crops of the full frame, so a
+            # second detection stage only adds latency.
+            raise ValueError('face_detector.roi_detection is only supported '
+                             'by the dlib and face_alignment detectors.')
         if self.mode == 'dlib':
             self.detector = dlib.get_frontal_face_detector()
             self.predictor = dlib.shape_predictor(
@@ -39,7 +93,20 @@ class LandmarkEstimator:
         else:
             raise ValueError
 
+    def _to_rgb(self, image: np.ndarray) -> np.ndarray:
+        """Convert a BGR frame to RGB once for both the detector and the
+        landmark predictor.
+
+        The conversion writes into a contiguous buffer that is reused for
+        the following frames of the same size, so the returned array is
+        only valid until the next call.
+        """
+        self._rgb_buffer = _bgr_to_rgb(image, self._rgb_buffer)
+        return self._rgb_buffer
+
     def detect_faces(self, image: np.ndarray) -> List[Face]:
+        if self.roi_detection:
+            return self._detect_faces_roi(image)
         if self.mode == 'dlib':
             return self._detect_faces_dlib(image)
         elif self.mode == 'face_alignment_dlib':
@@ -52,10 +119,11 @@ class LandmarkEstimator:
             raise ValueError
 
     def _detect_faces_dlib(self, image: np.ndarray) -> List[Face]:
-        bboxes = self.detector(image[:, :, ::-1], 0)
+        rgb = self._to_rgb(image)
+        bboxes = self.detector(rgb, 0)
         detected = []
         for bbox in bboxes:
-            predictions = self.predictor(image[:, :, ::-1], bbox)
+            predictions = self.predictor(rgb, bbox)
             landmarks = np.array([(pt.x, pt.y) for pt in predictions.parts()],
                                  dtype=np.float64)
             bbox = np.array([[bbox.left(), bbox.top()],
@@ -66,13 +134,13 @@ class LandmarkEstimator:
 
     def _detect_faces_face_alignment_dlib(self,
                                           image: np.ndarray) -> List[Face]:
-        bboxes = self.detector(image[:, :, ::-1], 0)
+        rgb = self._to_rgb(image)
+        bboxes = self.detector(rgb, 0)
         bboxes = [[bbox.left(),
                    bbox.top(),
                    bbox.right(),
                    bbox.bottom()] for bbox in bboxes]
-        predictions = self.predictor.get_landmarks(image[:, :, ::-1],
-                                                   detected_faces=bboxes)
+        predictions = self.predictor.get_landmarks(rgb, detected_faces=bboxes)
         if predictions is None:
             predictions = []
         detected = []
@@ -83,10 +151,10 @@ class LandmarkEstimator:
 
     def _detect_faces_face_alignment_sfd(self,
                                          image: np.ndarray) -> List[Face]:
-        bboxes = self.detector.detect_from_image(image[:, :, ::-1].copy())
+        rgb = self._to_rgb(image)
+        bboxes = self.detector.detect_from_image(rgb)
         bboxes = [bbox[:4] for bbox in bboxes]
-        predictions = self.predictor.get_landmarks(image[:, :, ::-1],
-                                                   detected_faces=bboxes)
+        predictions = self.predictor.get_landmarks(rgb, detected_faces=bboxes)
         if predictions is None:
             predictions = []
         detected = []
@@ -97,14 +165,84 @@ class LandmarkEstimator:
 
     def _detect_faces_mediapipe(self, image: np.ndarray) -> List[Face]:
         h, w = image.shape[:2]
-        predictions = self.detector.process(image[:, :, ::-1])
+        predictions = self.detector.process(self._to_rgb(image))
         detected = []
         if predictions.multi_face_landmarks:
             for prediction in predictions.multi_face_landmarks:
-                pts = np.array([(pt.x * w, pt.y * h)
-                                for pt in prediction.landmark],
-                               dtype=np.float64)
+                pts = _landmarks_to_array(prediction, w, h)
                 bbox = np.vstack([pts.min(axis=0), pts.max(axis=0)])
                 bbox = np.round(bbox).astype(np.int32)
                 detected.append(Face(bbox, pts))
         return detected
+
+    def _detect_faces_roi(self, image: np.ndarray) -> List[Face]:
+        """Detect faces in two stages.
+
+        Faces are detected in a downscaled frame, and then the landmarks
+        are estimated only in the full-resolution crops around them, so
+        that neither stage has to process the full-resolution frame.
+        """
+        detected = []
+        for bbox in self._detect_bboxes_downscaled(image):
+            (x0, y0), (x1, y1) = self._compute_roi(bbox, image.shape)
+            offset = np.array([x0, y0], dtype=np.float64)
+            landmarks = self._estimate_landmarks_in_roi(
+                image[y0:y1, x0:x1], bbox - offset)
+            if landmarks is None:
+                continue
+            landmarks += offset
+            detected.append(Face(bbox, landmarks))
+        return detected
+
+    def _detect_bboxes_downscaled(self, image: np.ndarray) -> List[np.ndarray]:
+        scale = self.roi_detection_scale
+        small = cv2.resize(image,
+                           None,
+                           fx=scale,
+                           fy=scale,
+                           interpolation=cv2.INTER_AREA)
+        small = self._to_rgb(small)
+        if self.mode in ['dlib', 'face_alignment_dlib']:
+            bboxes = self.detector(small, 0)
+            bboxes = [[bbox.left(),
+                       bbox.top(),
+                       bbox.right(),
+                       bbox.bottom()] for bbox in bboxes]
+        elif self.mode == 'face_alignment_sfd':
+            bboxes = self.detector.detect_from_image(small)
+            bboxes = [bbox[:4] for bbox in bboxes]
+        else:
+            raise ValueError
+        return [
+            np.array(bbox, dtype=np.float64).reshape(2, 2) / scale
+            for bbox in bboxes
+        ]
+
+    def _compute_roi(self, bbox: np.ndarray,
+                     image_shape: Tuple[int, ...]) -> np.ndarray:
+        h, w = image_shape[:2]
+        margin = (bbox[1] - bbox[0]) * self.ROI_MARGIN
+        roi = np.vstack([bbox[0] - margin, bbox[1] + margin])
+        roi = np.round(roi).astype(np.int64)
+        return np.clip(roi, 0, [w, h])
+
+    def _estimate_landmarks_in_roi(self, roi: np.ndarray,
+                                   bbox: np.ndarray) -> Optional[np.ndarray]:
+        if roi.size == 0:
+            return None
+        # The crops are small, so they are converted into new arrays
+        # instead of the frame buffer.
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
+        if self.mode == 'dlib':
+            bbox = np.round(bbox).astype(np.int64).ravel().tolist()
+            predictions = self.predictor(roi, dlib.rectangle(*bbox))
+            return np.array([(pt.x, pt.y) for pt in predictions.parts()],
+                            dtype=np.float64)
+        elif self.mode in ['face_alignment_dlib', 'face_alignment_sfd']:
+            predictions = self.predictor.get_landmarks(
+                roi, detected_faces=[bbox.ravel()])
+            if not predictions:
+                return None
+            return predictions[0].astype(np.float64)
+        else:
+            raise ValueError
@@ -0,0 +1,131 @@
+from typing import List, Optional
+
+import cv2
+import numpy as np
+from omegaconf import DictConfig
+
+from ..common import Face
+from .face_landmark_estimator import LandmarkEstimator
+
+
+def _compute_iou(bbox0: np.ndarray, bbox1: np.ndarray) -> float:
+    top_left = np.maximum(bbox0[0], bbox1[0])
+    bottom_right = np.minimum(bbox0[1], bbox1[1])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None))
+    area0 = np.prod(bbox0[1] - bbox0[0])
+    area1 = np.prod(bbox1[1] - bbox1[0])
+    union = area0 + area1 - intersection
+    return float(intersection / union) if union > 0 else 0.
+
+
+class FaceTracker:
+    """Track faces over consecutive video frames.
+
+    The full face detection and landmark estimation runs only every
+    ``detection_interval`` frames. In between, the landmarks of the
+    previous frame are propagated with pyramidal Lucas-Kanade optical
+    flow, and the bounding boxes follow the similarity transform fitted
+    to the tracked landmarks. When too few landmarks of a face survive
+    the forward-backward consistency check, the track is considered
+    lost and the full detection runs on that frame.
+
+    Each face keeps its ``face_id`` while it's tracked, and detected
+    faces take over the ID of the previous face they overlap the most.
+    """
+    MIN_TRACKED_RATIO = 0.8
+    MAX_FORWARD_BACKWARD_ERROR = 1.0
+    MIN_IOU = 0.3
+    LK_PARAMS = dict(winSize=(15, 15),
+                     maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS
+                               | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    def __init__(self, landmark_estimator: LandmarkEstimator,
+                 config: DictConfig):
+        self._landmark_estimator = landmark_estimator
+        self.detection_interval = config.face_detector.detection_interval
+
+        self._prev_gray: Optional[np.ndarray] = None
+        self._faces: List[Face] = []
+        self._frames_since_detection = 0
+        self._next_face_id = 0
+
+    def reset(self) -> None:
+        self._prev_gray = None
+        self._faces = []
+        self._frames_since_detection = 0
+
+    def track(self, image: np.ndarray) -> List[Face]:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = None
+        if (self._prev_gray is not None and self._faces
+                and self._frames_since_detection < self.detection_interval
+                and self._prev_gray.shape == gray.shape):
+            faces = self._propagate(gray)
+        if faces is None:
+            faces = self._detect(image)
+            self._frames_since_detection = 0
+        self._frames_since_detection += 1
+        self._prev_gray = gray
+        self._faces = faces
+        return faces
+
+    def _detect(self, image: np.ndarray) -> List[Face]:
+        faces = self._landmark_estimator.detect_faces(image)
+        unmatched = list(self._faces)
+        for face in faces:
+            ious = [_compute_iou(face.bbox, prev.bbox) for prev in unmatched]
+            if ious and max(ious) >= self.MIN_IOU:
+                face.face_id = unmatched.pop(int(np.argmax(ious))).face_id
+            else:
+                face.face_id = self._next_face_id
+                self._next_face_id += 1
+        return faces
+
+    def _propagate(self, gray: np.ndarray) -> Optional[List[Face]]:
+        # Track the landmarks of all the faces with a single call
+        prev_points = np.vstack([face.landmarks for face in self._faces])
+        prev_points = prev_points.astype(np.float32).reshape(-1, 1, 2)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray,
+                                                     prev_points, None,
+                                                     **self.LK_PARAMS)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            gray, self._prev_gray, points, None, **self.LK_PARAMS)
+        error = np.linalg.norm(back_points - prev_points, axis=2).ravel()
+        valid = ((status.ravel() == 1) & (back_status.ravel() == 1)
+                 & (error < self.MAX_FORWARD_BACKWARD_ERROR))
+        prev_points = prev_points.reshape(-1, 2)
+        points = points.reshape(-1, 2)
+
+        faces = []
+        start = 0
+        for prev_face in self._faces:
+            end = start + len(prev_face.landmarks)
+            face_valid = valid[start:end]
+            if face_valid.mean() < self.MIN_TRACKED_RATIO:
+                return None
+            matrix, _ = cv2.estimateAffinePartial2D(
+                prev_points[start:end][face_valid],
+                points[start:end][face_valid])
+            if matrix is None:
+                return None
+
+            # Landmarks that were not tracked reliably follow the motion
+            # of the whole face.
+            landmarks = prev_face.landmarks @ matrix[:, :2].T + matrix[:, 2]
+            landmarks[face_valid] = points[start:end][face_valid]
+            bbox = self._transform_bbox(prev_face.bbox, matrix)
+
+            face = Face(bbox, landmarks.astype(np.float64))
+            face.face_id = prev_face.face_id
+            faces.append(face)
+            start = end
+        return faces
+
+    @staticmethod
+    def _transform_bbox(bbox: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        (x0, y0), (x1, y1) = bbox
+        corners = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+                           dtype=np.float64)
+        corners = corners @ matrix[:, :2].T + matrix[:, 2]
+        return np.vstack([corners.min(axis=0), corners.max(axis=0)])
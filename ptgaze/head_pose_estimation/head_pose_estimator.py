@@ -0,0 +1,255 @@
+import time
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from omegaconf import DictConfig
+from scipy.spatial.transform import Rotation
+
+from ..common import Camera, Face
+from ..common.face_model import FaceModel
+
+
+def _skew(vectors: np.ndarray) -> np.ndarray:
+    """Cross product matrices of vectors of shape (..., 3)"""
+    matrices = np.zeros(vectors.shape + (3, ))
+    matrices[..., 0, 1] = -vectors[..., 2]
+    matrices[..., 0, 2] = vectors[..., 1]
+    matrices[..., 1, 2] = -vectors[..., 0]
+    return matrices - matrices.swapaxes(-1, -2)
+
+
+def _rotvecs_to_matrices(rotvecs: np.ndarray) -> np.ndarray:
+    """Rodrigues' formula for rotation vectors of shape (N, 3)"""
+    angles = np.linalg.norm(rotvecs, axis=1)[:, None, None]
+    axes = _skew(rotvecs / np.maximum(angles[:, :, 0], 1e-12))
+    return (np.eye(3) + np.sin(angles) * axes +
+            (1 - np.cos(angles)) * axes @ axes)
+
+
+class HeadPoseEstimator:
+    """Estimate the head poses by fitting the 3D face model to the
+    landmarks.
+
+    Faces tracked over video frames (those with a ``face_id``) start the
+    fit from the pose of the previous frame instead of the default pose,
+    which takes fewer iterations. Optionally, only the landmarks of
+    ``FaceModel.STABLE_INDICES`` are fitted.
+
+    With the ``opencv`` solver, each face is fitted with
+    ``cv2.solvePnP``. With the ``batched`` solver, all the faces are
+    fitted at once with a vectorized Levenberg-Marquardt, which also
+    counts the iterations.
+    """
+    MAX_ITERATIONS = 50
+    MAX_DAMPING = 1e10
+    # The fit of a face stops when the squared norm of the update of the
+    # rotation vector (rad) and the translation (m) or the relative
+    # decrease of the cost gets smaller than these.
+    MIN_STEP = 1e-12
+    MIN_COST_DECREASE = 1e-8
+
+    def __init__(self, face_model: FaceModel, camera: Camera,
+                 config: DictConfig):
+        self._camera = camera
+        self.warm_start = config.head_pose_estimator.warm_start
+        self.solver = config.head_pose_estimator.solver
+        if self.solver not in ['opencv', 'batched']:
+            raise ValueError
+        if config.head_pose_estimator.use_stable_landmarks:
+            self._indices = face_model.STABLE_INDICES
+        else:
+            self._indices = np.arange(len(face_model.LANDMARKS))
+        self._points3d = face_model.LANDMARKS[self._indices]
+
+        self._prev_poses: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+        self.total_faces = 0
+        self.total_warm_starts = 0
+        self.total_iterations = 0  # Only counted by the batched solver
+        self.total_time = 0.  # Seconds
+
+    def reset(self) -> None:
+        self._prev_poses = {}
+
+    def estimate(self, faces: List[Face]) -> None:
+        if not faces:
+            self.reset()
+            return
+        start = time.perf_counter()
+        rvecs, tvecs, warm = self._get_initial_poses(faces)
+        landmarks = np.stack([face.landmarks[self._indices] for face in faces])
+        if self.solver == 'opencv':
+            rvecs, tvecs = self._solve_opencv(landmarks, rvecs, tvecs)
+        else:
+            rvecs, tvecs, iterations = self._solve_batched(
+                landmarks, rvecs, tvecs, warm)
+            self.total_iterations += int(iterations.sum())
+
+        for face, rot, tvec in zip(faces, Rotation.from_rotvec(rvecs), tvecs):
+            face.head_pose_rot = rot
+            face.head_position = tvec
+            face.reye.head_pose_rot = rot
+            face.leye.head_pose_rot = rot
+
+        # Faces which are not in this frame anymore lost their track.
+        if self.warm_start:
+            self._prev_poses = {
+                face.face_id: (rvec, tvec)
+                for face, rvec, tvec in zip(faces, rvecs, tvecs)
+                if face.face_id is not None
+            }
+        self.total_faces += len(faces)
+        self.total_time += time.perf_counter() - start
+
+    def _get_initial_poses(
+            self,
+            faces: List[Face]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # See FaceModel.estimate_head_pose for the default pose.
+        rvecs = np.zeros((len(faces), 3), dtype=np.float64)
+        tvecs = np.tile(np.array([0, 0, 1], dtype=np.float64), (len(faces), 1))
+        warm = np.zeros(len(faces), dtype=bool)
+        if not self.warm_start:
+            return rvecs, tvecs, warm
+        for index, face in enumerate(faces):
+            if face.face_id in self._prev_poses:
+                rvecs[index], tvecs[index] = self._prev_poses[face.face_id]
+                warm[index] = True
+        self.total_warm_starts += int(warm.sum())
+        return rvecs, tvecs, warm
+
+    def _solve_opencv(self, landmarks: np.ndarray, rvecs: np.ndarray,
+                      tvecs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rvecs = rvecs.copy()
+        tvecs = tvecs.copy()
+        for index, points2d in enumerate(landmarks):
+            _, rvec, tvec = cv2.solvePnP(self._points3d,
+                                         points2d,
+                                         self._camera.camera_matrix,
+                                         self._camera.dist_coefficients,
+                                         rvecs[index],
+                                         tvecs[index],
+                                         useExtrinsicGuess=True,
+                                         flags=cv2.SOLVEPNP_ITERATIVE)
+            rvecs[index] = rvec.ravel()
+            tvecs[index] = tvec.ravel()
+        return rvecs, tvecs
+
+    def _solve_batched(
+            self, landmarks: np.ndarray, rvecs: np.ndarray, tvecs: np.ndarray,
+            warm: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Fit the poses of all the faces at once.
+
+        The reprojection error is minimized in normalized image
+        coordinates, after removing the lens distortion from the
+        landmarks. The rotations are updated by left-multiplying the
+        rotation of the step.
+
+        Unlike cv2.solvePnP, this easily runs away from the default pose,
+        in which the face model is turned away from the camera, so the
+        faces without a previous pose start from the frontal pose that
+        matches the position and the size of their landmarks.
+        """
+        n_faces = len(landmarks)
+        points2d = cv2.undistortPoints(
+            landmarks.reshape(-1, 1, 2).astype(np.float64),
+            self._camera.camera_matrix,
+            self._camera.dist_coefficients).reshape(n_faces, -1, 2)
+        rots = Rotation.from_rotvec(rvecs).as_matrix()
+        tvecs = tvecs.copy()
+        if not warm.all():
+            rots[~warm], tvecs[~warm] = self._compute_frontal_poses(
+                points2d[~warm])
+
+        rotated, residuals = self._compute_residuals(rots, tvecs, points2d)
+        costs = np.einsum('ij,ij->i', residuals, residuals)
+        dampings = np.full(n_faces, 1e-3)
+        iterations = np.zeros(n_faces, dtype=np.int64)
+        active = np.ones(n_faces, dtype=bool)
+        for _ in range(self.MAX_ITERATIONS):
+            indices = np.flatnonzero(active)
+            if len(indices) == 0:
+                break
+            iterations[indices] += 1
+
+            jacobians = self._compute_jacobians(rotated[indices],
+                                                tvecs[indices])
+            jacobians_t = jacobians.transpose(0, 2, 1)
+            hessians = jacobians_t @ jacobians
+            gradients = (jacobians_t @ residuals[indices][..., None])[..., 0]
+            diagonals = np.maximum(np.diagonal(hessians, axis1=1, axis2=2),
+                                   1e-12)
+            damped = hessians + (dampings[indices, None, None] * np.eye(6) *
+                                 diagonals[:, None, :])
+            steps = -np.linalg.solve(damped, gradients[..., None])[..., 0]
+
+            new_rots = _rotvecs_to_matrices(steps[:, :3]) @ rots[indices]
+            new_tvecs = tvecs[indices] + steps[:, 3:]
+            new_rotated, new_residuals = self._compute_residuals(
+                new_rots, new_tvecs, points2d[indices])
+            new_costs = np.einsum('ij,ij->i', new_residuals, new_residuals)
+
+            prev_costs = costs[indices]
+            accepted = new_costs < prev_costs
+            updated = indices[accepted]
+            rots[updated] = new_rots[accepted]
+            tvecs[updated] = new_tvecs[accepted]
+            rotated[updated] = new_rotated[accepted]
+            residuals[updated] = new_residuals[accepted]
+            costs[updated] = new_costs[accepted]
+            dampings[indices] = np.where(accepted, dampings[indices] / 10,
+                                         dampings[indices] * 10)
+
+            converged = ((np.einsum('ij,ij->i', steps, steps) < self.MIN_STEP)
+                         | (accepted & (prev_costs - new_costs <
+                                        self.MIN_COST_DECREASE * prev_costs))
+                         | (dampings[indices] > self.MAX_DAMPING))
+            active[indices[converged]] = False
+
+        rvecs = Rotation.from_matrix(rots).as_rotvec()
+        return rvecs, tvecs, iterations
+
+    def _compute_frontal_poses(
+            self, points2d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # The face model faces the camera when rotated 180 degrees around
+        # the Y axis.
+        rot = np.diag([-1., 1., -1.])
+        rotated = self._points3d @ rot.T
+        model_center = rotated.mean(axis=0)
+        model_size = np.linalg.norm(rotated[:, :2] - model_center[:2],
+                                    axis=1).mean()
+
+        centers = points2d.mean(axis=1)
+        sizes = np.linalg.norm(points2d - centers[:, None],
+                               axis=2).mean(axis=1)
+        distances = model_size / sizes
+        # The model center is projected to the center of the landmarks at
+        # the distance where the sizes match.
+        tvecs = (np.hstack([centers, np.ones(
+            (len(centers), 1))]) * distances[:, None] - model_center)
+        return np.tile(rot, (len(points2d), 1, 1)), tvecs
+
+    def _compute_residuals(
+            self, rots: np.ndarray, tvecs: np.ndarray,
+            points2d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rotated = self._points3d @ rots.transpose(0, 2, 1)
+        points3d = rotated + tvecs[:, None]
+        projected = points3d[..., :2] / points3d[..., 2:]
+        residuals = (projected - points2d).reshape(len(rots), -1)
+        return rotated, residuals
+
+    @staticmethod
+    def _compute_jacobians(rotated: np.ndarray,
+                           tvecs: np.ndarray) -> np.ndarray:
+        points3d = rotated + tvecs[:, None]
+        inv_z = 1 / points3d[..., 2]
+        # Derivatives of the projection with respect to the 3D points
+        projection_jacobians = np.zeros(points3d.shape[:-1] + (2, 3))
+        projection_jacobians[..., 0, 0] = inv_z
+        projection_jacobians[..., 1, 1] = inv_z
+        projection_jacobians[..., 2] = -points3d[..., :2] * inv_z[..., None]**2
+        # The derivative of exp([w]) R X with respect to w is -[R X]
+        rotation_jacobians = projection_jacobians @ -_skew(rotated)
+        jacobians = np.concatenate([rotation_jacobians, projection_jacobians],
+                                   axis=-1)
+        return jacobians.reshape(len(rotated), -1, 6)
@@ -1,3 +1,5 @@
+from typing import List
+
 import cv2
 import numpy as np
 from scipy.spatial.transform import Rotation
@@ -5,36 +7,79 @@ from scipy.spatial.transform import Rotation
 from ..common import Camera, FaceParts, FacePartsName
 
 
-def _normalize_vector(vector: np.ndarray) -> np.ndarray:
-    return vector / np.linalg.norm(vector)
+def _normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
 
 
 class HeadPoseNormalizer:
-    def __init__(self, camera: Camera, normalized_camera: Camera,
-                 normalized_distance: float):
+    """Warp the eyes or faces to the normalized camera.
+
+    If ``distorted_images`` is true, the images are raw frames which are
+    not undistorted, and the lens distortion is removed by the warp itself.
+    The maps of cv2.remap are computed per part with
+    cv2.initUndistortRectifyMap, whose rectification is the conversion to
+    the normalized camera, so no pixel is interpolated twice.
+    """
+    def __init__(self,
+                 camera: Camera,
+                 normalized_camera: Camera,
+                 normalized_distance: float,
+                 distorted_images: bool = False):
         self.camera = camera
         self.normalized_camera = normalized_camera
         self.normalized_distance = normalized_distance
+        self.distorted_images = bool(distorted_images
+                                     and camera.dist_coefficients.any())
+
+        # These only depend on the cameras, so they are computed once.
+        self._camera_matrix_inv = np.linalg.inv(self.camera.camera_matrix)
+        self._normalized_size = (self.normalized_camera.width,
+                                 self.normalized_camera.height)
 
     def normalize(self, image: np.ndarray, eye_or_face: FaceParts) -> None:
-        eye_or_face.normalizing_rot = self._compute_normalizing_rotation(
-            eye_or_face.center, eye_or_face.head_pose_rot)
-        self._normalize_image(image, eye_or_face)
-        self._normalize_head_pose(eye_or_face)
+        self.normalize_batch(image, [eye_or_face])
 
-    def _normalize_image(self, image: np.ndarray,
-                         eye_or_face: FaceParts) -> None:
-        camera_matrix_inv = np.linalg.inv(self.camera.camera_matrix)
-        normalized_camera_matrix = self.normalized_camera.camera_matrix
+    def normalize_batch(self, image: np.ndarray,
+                        eyes_or_faces: List[FaceParts]) -> None:
+        """Normalize several eyes or faces of the same image.
 
-        scale = self._get_scale_matrix(eye_or_face.distance)
-        conversion_matrix = scale @ eye_or_face.normalizing_rot.as_matrix()
+        The normalizing rotations, the projection matrices and the
+        normalized head poses of all the parts are computed at once with
+        vectorized operations, and then each part is warped.
+        """
+        if not eyes_or_faces:
+            return
+        centers = np.stack([part.center.ravel() for part in eyes_or_faces])
+        head_rots = np.stack(
+            [part.head_pose_rot.as_matrix() for part in eyes_or_faces])
 
-        projection_matrix = normalized_camera_matrix @ conversion_matrix @ camera_matrix_inv
+        normalizing_rots = self._compute_normalizing_rotations(
+            centers, head_rots)
+        conversion_matrices = self._compute_conversion_matrices(
+            normalizing_rots, np.linalg.norm(centers, axis=1))
+        normalized_head_rots2d = self._compute_normalized_head_rots2d(
+            head_rots, normalizing_rots)
 
-        normalized_image = cv2.warpPerspective(
-            image, projection_matrix,
-            (self.normalized_camera.width, self.normalized_camera.height))
+        normalizing_rots = Rotation.from_matrix(normalizing_rots)
+        for index, eye_or_face in enumerate(eyes_or_faces):
+            eye_or_face.normalizing_rot = normalizing_rots[index]
+            eye_or_face.normalized_head_rot2d = normalized_head_rots2d[index]
+            self._normalize_image(image, eye_or_face,
+                                  conversion_matrices[index])
+
+    def _normalize_image(self, image: np.ndarray, eye_or_face: FaceParts,
+                         conversion_matrix: np.ndarray) -> None:
+        if self.distorted_images:
+            maps = cv2.initUndistortRectifyMap(
+                self.camera.camera_matrix, self.camera.dist_coefficients,
+                conversion_matrix, self.normalized_camera.camera_matrix,
+                self._normalized_size, cv2.CV_32FC1)
+            normalized_image = cv2.remap(image, *maps, cv2.INTER_LINEAR)
+        else:
+            projection_matrix = (self.normalized_camera.camera_matrix
+                                 @ conversion_matrix @ self._camera_matrix_inv)
+            normalized_image = cv2.warpPerspective(image, projection_matrix,
+                                                   self._normalized_size)
 
         if eye_or_face.name in {FacePartsName.REYE, FacePartsName.LEYE}:
             normalized_image = cv2.cvtColor(normalized_image,
@@ -43,26 +88,28 @@ class HeadPoseNormalizer:
         eye_or_face.normalized_image = normalized_image
 
     @staticmethod
-    def _normalize_head_pose(eye_or_face: FaceParts) -> None:
-        normalized_head_rot = eye_or_face.head_pose_rot * eye_or_face.normalizing_rot
-        euler_angles2d = normalized_head_rot.as_euler('XYZ')[:2]
-        eye_or_face.normalized_head_rot2d = euler_angles2d * np.array([1, -1])
+    def _compute_normalized_head_rots2d(
+            head_rots: np.ndarray, normalizing_rots: np.ndarray) -> np.ndarray:
+        normalized_head_rots = Rotation.from_matrix(
+            head_rots @ normalizing_rots)
+        euler_angles2d = normalized_head_rots.as_euler('XYZ')[:, :2]
+        return euler_angles2d * np.array([1, -1])
 
     @staticmethod
-    def _compute_normalizing_rotation(center: np.ndarray,
-                                      head_rot: Rotation) -> Rotation:
+    def _compute_normalizing_rotations(centers: np.ndarray,
+                                       head_rots: np.ndarray) -> np.ndarray:
         # See section 4.2 and Figure 9 of https://arxiv.org/abs/1711.09017
-        z_axis = _normalize_vector(center.ravel())
-        head_rot = head_rot.as_matrix()
-        head_x_axis = head_rot[:, 0]
-        y_axis = _normalize_vector(np.cross(z_axis, head_x_axis))
-        x_axis = _normalize_vector(np.cross(y_axis, z_axis))
-        return Rotation.from_matrix(np.vstack([x_axis, y_axis, z_axis]))
-
-    def _get_scale_matrix(self, distance: float) -> np.ndarray:
-        return np.array([
-            [1, 0, 0],
-            [0, 1, 0],
-            [0, 0, self.normalized_distance / distance],
-        ],
-                        dtype=np.float64)
+        z_axes = _normalize_vectors(centers)
+        head_x_axes = head_rots[:, :, 0]
+        y_axes = _normalize_vectors(np.cross(z_axes, head_x_axes))
+        x_axes = _normalize_vectors(np.cross(y_axes, z_axes))
+        return np.stack([x_axes, y_axes, z_axes], axis=1)
+
+    def _compute_conversion_matrices(self, normalizing_rots: np.ndarray,
+                                     distances: np.ndarray) -> np.ndarray:
+        # Multiplying the scale matrix diag(1, 1, s) from the left only
+        # scales the last row of the rotation matrix.
+        scales = self.normalized_distance / distances
+        conversion_matrices = normalizing_rots.copy()
+        conversion_matrices[:, 2] *= scales[:, None]
+        return conversion_matrices
@@ -1,6 +1,7 @@
 import argparse
+import importlib
 import logging
-import pathlib
+import sys
 import warnings
 
 import torch
@@ -8,12 +9,20 @@ from omegaconf import DictConfig, OmegaConf
 
 from .demo import Demo
 from .utils import (check_path_all, download_dlib_pretrained_model,
-                    download_ethxgaze_model, download_mpiifacegaze_model,
-                    download_mpiigaze_model, expanduser_all,
-                    generate_dummy_camera_params)
+                    download_gaze_model, expanduser_all,
+                    generate_dummy_camera_params, load_config_file,
+                    load_packaged_config)
 
 logger = logging.getLogger(__name__)
 
+# `ptgaze <command> ...` runs the main function of the module of the
+# command with the remaining arguments. Without a command, the demo runs.
+COMMANDS = {
+    'batch': '.batch',
+    'export': '.export',
+    'quantize': '.quantize',
+}
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
@@ -62,6 +71,12 @@ def parse_args() -> argparse.Namespace:
         type=str,
         help='If specified, the overlaid video will be saved to this directory.'
     )
+    parser.add_argument(
+        '--results',
+        type=str,
+        help='If specified, the estimated head poses and gazes are saved to '
+        'this file. The format is given by the extension: .parquet, .npz or '
+        '.jsonl.')
     parser.add_argument('--ext',
                         '-e',
                         type=str,
@@ -77,17 +92,7 @@ def parse_args() -> argparse.Namespace:
 
 
 def load_mode_config(args: argparse.Namespace) -> DictConfig:
-    package_root = pathlib.Path(__file__).parent.resolve()
-    if args.mode == 'mpiigaze':
-        path = package_root / 'data/configs/mpiigaze.yaml'
-    elif args.mode == 'mpiifacegaze':
-        path = package_root / 'data/configs/mpiifacegaze.yaml'
-    elif args.mode == 'eth-xgaze':
-        path = package_root / 'data/configs/eth-xgaze.yaml'
-    else:
-        raise ValueError
-    config = OmegaConf.load(path)
-    config.PACKAGE_ROOT = package_root.as_posix()
+    config = load_packaged_config(args.mode)
 
     if args.face_detector:
         config.face_detector.mode = args.face_detector
@@ -110,23 +115,30 @@ def load_mode_config(args: argparse.Namespace) -> DictConfig:
         config.gaze_estimator.use_dummy_camera_params = True
     if args.output_dir:
         config.demo.output_dir = args.output_dir
+    if args.results:
+        config.demo.results_path = args.results
     if args.ext:
         config.demo.output_file_extension = args.ext
     if args.no_screen:
         config.demo.display_on_screen = False
-        if not config.demo.output_dir:
+        if not config.demo.output_dir and not config.demo.results_path:
             config.demo.output_dir = 'outputs'
 
     return config
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        module = importlib.import_module(COMMANDS[sys.argv[1]], __package__)
+        module.main(sys.argv[2:])
+        return
+
     args = parse_args()
     if args.debug:
         logging.getLogger('ptgaze').setLevel(logging.DEBUG)
 
     if args.config:
-        config = OmegaConf.load(args.config)
+        config = load_config_file(args.config)
     elif args.mode:
         config = load_mode_config(args)
     else:
@@ -142,12 +154,7 @@ def main():
     if config.face_detector.mode == 'dlib':
         download_dlib_pretrained_model()
     if args.mode:
-        if config.mode == 'MPIIGaze':
-            download_mpiigaze_model()
-        elif config.mode == 'MPIIFaceGaze':
-            download_mpiifacegaze_model()
-        elif config.mode == 'ETH-XGaze':
-            download_ethxgaze_model()
+        download_gaze_model(config)
 
     check_path_all(config)
 
@@ -1,9 +1,13 @@
 import importlib
+from typing import Callable
 
 import timm
 import torch
 from omegaconf import DictConfig
 
+from ..utils import EXPORTED_MODEL_SUFFIXES, get_exported_model_path
+from .onnxruntime_model import OnnxRuntimeModel
+
 
 def create_model(config: DictConfig) -> torch.nn.Module:
     mode = config.mode
@@ -18,3 +22,52 @@ def create_model(config: DictConfig) -> torch.nn.Module:
     device = torch.device(config.device)
     model.to(device)
     return model
+
+
+def load_model(config: DictConfig) -> torch.nn.Module:
+    """Create the model and load the weights of the checkpoint."""
+    model = create_model(config)
+    checkpoint = torch.load(config.gaze_estimator.checkpoint,
+                            map_location='cpu')
+    model.load_state_dict(checkpoint['model'])
+    model.to(torch.device(config.device))
+    model.eval()
+    return model
+
+
+def load_inference_model(config: DictConfig) -> Callable[..., torch.Tensor]:
+    """Load the model for ``config.gaze_estimator.inference_backend``.
+
+    The exported backends load the file created by ``ptgaze export``, or
+    by ``ptgaze quantize`` if ``config.gaze_estimator.quantized`` is true.
+    """
+    backend = config.gaze_estimator.inference_backend
+    if config.gaze_estimator.quantized and (backend != 'torchscript'
+                                            or config.device != 'cpu'):
+        raise ValueError('The quantized models are TorchScript models that '
+                         'run on CPU. Set gaze_estimator.inference_backend '
+                         'to torchscript and device to cpu.')
+    if backend == 'pytorch':
+        model = load_model(config)
+        if config.gaze_estimator.compile:
+            model = torch.compile(model)
+        return model
+    elif backend not in EXPORTED_MODEL_SUFFIXES:
+        raise ValueError(f'Unknown inference backend: {backend}')
+
+    path = get_exported_model_path(config)
+    if not path.exists():
+        command = ('ptgaze quantize' if config.gaze_estimator.quantized else
+                   f'ptgaze export --format {backend}')
+        raise FileNotFoundError(
+            f'{path.as_posix()} not found. Create it with `{command}`.')
+    device = torch.device(config.device)
+    if backend == 'torchscript':
+        return torch.jit.load(path.as_posix(), map_location=device)
+    elif backend == 'torch_export':
+        return torch.export.load(path.as_posix()).module()
+    else:
+        return OnnxRuntimeModel(
+            path.as_posix(), device,
+            config.gaze_estimator.onnxruntime_intra_op_threads,
+            config.gaze_estimator.onnxruntime_inter_op_threads)
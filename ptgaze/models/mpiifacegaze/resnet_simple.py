@@ -26,6 +26,6 @@ class Model(nn.Module):
         x = self.feature_extractor(x)
         y = F.relu(self.conv(x))
         x = x * y
-        x = x.view(x.size(0), -1)
+        x = torch.flatten(x, 1)
         x = self.fc(x)
         return x
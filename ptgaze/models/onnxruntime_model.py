@@ -0,0 +1,43 @@
+from typing import List
+
+import numpy as np
+import torch
+
+
+class OnnxRuntimeModel:
+    """Run a model exported to ONNX with ONNX Runtime.
+
+    The model is called with and returns torch tensors like the PyTorch
+    model, so that GazeEstimator can use either of them.
+    """
+    def __init__(self,
+                 path: str,
+                 device: torch.device,
+                 intra_op_num_threads: int = 0,
+                 inter_op_num_threads: int = 0):
+        # ONNX Runtime is only needed for this backend.
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        # 0 means the default of ONNX Runtime.
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+        self._session = onnxruntime.InferenceSession(path,
+                                                     options,
+                                                     providers=providers)
+        self._input_names: List[str] = [
+            node.name for node in self._session.get_inputs()
+        ]
+
+    def __call__(self, *inputs: torch.Tensor) -> torch.Tensor:
+        feeds = {
+            name: np.ascontiguousarray(tensor.cpu().numpy())
+            for name, tensor in zip(self._input_names, inputs)
+        }
+        outputs = self._session.run(None, feeds)
+        return torch.from_numpy(outputs[0])
@@ -0,0 +1,231 @@
+"""Quantize the face gaze models to INT8 for CPU inference.
+
+The MPIIFaceGaze and ETH-XGaze models are quantized statically with FX
+graph mode quantization: the convolutions are fused with the following
+batch normalizations and ReLUs, and the activation ranges are calibrated
+on a directory of normalized face images, e.g.
+
+    ptgaze quantize --mode eth-xgaze --calibration-dir crops/
+
+The quantized model is saved as TorchScript, and it's loaded by
+GazeEstimator when ``gaze_estimator.quantized`` is true with the
+``torchscript`` inference backend.
+
+Afterwards, the angular difference between the gaze directions predicted
+by the FP32 and INT8 models and their latencies per frame are reported.
+Without ground truth, the angular difference bounds how much the angular
+error can change. It's measured on the images of ``--eval-dir``, or else
+on a held-out part of the calibration directory that isn't used for the
+calibration, since the calibrated images are the optimistic case.
+"""
+import argparse
+import copy
+import logging
+import pathlib
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from omegaconf import DictConfig
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from .export import create_example_inputs
+from .models import load_model
+from .transforms import create_batch_transform
+from .utils import (download_gaze_model, expanduser_all,
+                    get_exported_model_path, load_config_file,
+                    load_packaged_config)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.bmp', '.jpeg', '.jpg', '.png'}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='ptgaze quantize')
+    parser.add_argument('--config', type=str, help='Config file.')
+    parser.add_argument('--mode',
+                        type=str,
+                        choices=['mpiifacegaze', 'eth-xgaze'])
+    parser.add_argument(
+        '--calibration-dir',
+        type=str,
+        required=True,
+        help='Directory of normalized face images (BGR) used to calibrate '
+        'the activation ranges.')
+    parser.add_argument(
+        '--eval-dir',
+        type=str,
+        help='Directory of normalized face images used to compare the FP32 '
+        'and INT8 models. By default, --holdout of the calibration images '
+        'are used for the comparison instead of the calibration.')
+    parser.add_argument(
+        '--holdout',
+        type=float,
+        default=0.2,
+        help='Fraction of the calibration images held out for the '
+        'comparison when --eval-dir is not given.')
+    parser.add_argument('--max-images', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument(
+        '--output',
+        '-o',
+        type=str,
+        help='Output path. By default, the path from which GazeEstimator '
+        'loads the quantized model.')
+    return parser.parse_args(argv)
+
+
+def load_config(args: argparse.Namespace) -> DictConfig:
+    if args.config:
+        config = load_config_file(args.config)
+    elif args.mode:
+        config = load_packaged_config(args.mode)
+        download_gaze_model(config)
+    else:
+        raise ValueError(
+            'You need to specify one of \'--mode\' or \'--config\'.')
+    if config.mode not in ['MPIIFaceGaze', 'ETH-XGaze']:
+        raise ValueError('Only the MPIIFaceGaze and ETH-XGaze models can be '
+                         'quantized.')
+    # The quantized operators run on CPU only.
+    config.device = 'cpu'
+    config.gaze_estimator.inference_backend = 'torchscript'
+    config.gaze_estimator.quantized = True
+    if args.output:
+        config.gaze_estimator.exported_model = args.output
+    expanduser_all(config)
+    return config
+
+
+def find_images(image_dir: str, max_images: int) -> List[pathlib.Path]:
+    paths = sorted(path for path in pathlib.Path(image_dir).iterdir()
+                   if path.suffix.lower() in IMAGE_EXTENSIONS)[:max_images]
+    if not paths:
+        raise FileNotFoundError(f'No images found in {image_dir}.')
+    return paths
+
+
+def split_holdout(
+    paths: List[pathlib.Path], fraction: float
+) -> Tuple[List[pathlib.Path], List[pathlib.Path]]:
+    """Split the images into calibration and held-out images.
+
+    Every n-th image is held out rather than the last ones, so that both
+    parts cover e.g. all the subjects of a directory sorted by subject.
+    """
+    if not 0 < fraction < 1:
+        raise ValueError('--holdout must be between 0 and 1.')
+    step = max(2, round(1 / fraction))
+    holdout = paths[step - 1::step]
+    if not holdout:
+        raise ValueError(f'Too few calibration images ({len(paths)}) to '
+                         f'hold out {fraction:.0%} of them. Use --eval-dir.')
+    calibration = [
+        path for index, path in enumerate(paths) if index % step != step - 1
+    ]
+    return calibration, holdout
+
+
+def load_images(config: DictConfig, paths: List[pathlib.Path],
+                batch_size: int) -> List[torch.Tensor]:
+    """Load the images as model input batches."""
+    transform = create_batch_transform(config,
+                                       tuple(config.gaze_estimator.image_size))
+    batches = []
+    for start in range(0, len(paths), batch_size):
+        images = [
+            cv2.imread(path.as_posix())
+            for path in paths[start:start + batch_size]
+        ]
+        # The transform reuses its output tensor.
+        batches.append(transform(images).clone())
+    return batches
+
+
+@torch.no_grad()
+def quantize(model: torch.nn.Module, config: DictConfig,
+             batches: List[torch.Tensor]) -> torch.jit.ScriptModule:
+    example_inputs = create_example_inputs(config, 1)
+    qconfig_mapping = get_default_qconfig_mapping(
+        torch.backends.quantized.engine)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping,
+                          example_inputs)
+    for batch in batches:
+        prepared(batch)
+    quantized = convert_fx(prepared)
+    return torch.jit.freeze(torch.jit.trace(quantized, example_inputs))
+
+
+def _angles_to_vectors(angles: np.ndarray) -> np.ndarray:
+    # See FaceParts.angle_to_vector
+    pitches, yaws = angles[:, 0], angles[:, 1]
+    return -np.stack([
+        np.cos(pitches) * np.sin(yaws),
+        np.sin(pitches),
+        np.cos(pitches) * np.cos(yaws)
+    ],
+                     axis=1)
+
+
+@torch.no_grad()
+def compare(model: torch.nn.Module, quantized: torch.jit.ScriptModule,
+            config: DictConfig, batches: List[torch.Tensor],
+            eval_set: str) -> None:
+    predictions = np.vstack([model(batch).numpy() for batch in batches])
+    quantized_predictions = np.vstack(
+        [quantized(batch).numpy() for batch in batches])
+    cosines = np.sum(_angles_to_vectors(predictions) *
+                     _angles_to_vectors(quantized_predictions),
+                     axis=1)
+    differences = np.rad2deg(np.arccos(np.clip(cosines, -1, 1)))
+    logger.info(f'Angular difference from the FP32 model over '
+                f'{len(differences)} {eval_set}: '
+                f'mean {differences.mean():.3f} deg, '
+                f'p95 {np.percentile(differences, 95):.3f} deg, '
+                f'max {differences.max():.3f} deg')
+
+    frame = create_example_inputs(config, 1)
+    latencies = []
+    for name, net in [('FP32', model), ('INT8', quantized)]:
+        for _ in range(5):
+            net(*frame)
+        start = time.perf_counter()
+        for _ in range(50):
+            net(*frame)
+        latencies.append((time.perf_counter() - start) / 50 * 1000)
+        logger.info(f'{name} latency per frame: {latencies[-1]:.2f} ms')
+    logger.info(f'Latency change: {latencies[1] - latencies[0]:+.2f} ms '
+                f'({latencies[0] / latencies[1]:.2f}x faster)')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    config = load_config(args)
+    output_path = get_exported_model_path(config)
+
+    model = load_model(config)
+    calibration_paths = find_images(args.calibration_dir, args.max_images)
+    if args.eval_dir:
+        eval_paths = find_images(args.eval_dir, args.max_images)
+        eval_set = f'images of {args.eval_dir}'
+    else:
+        calibration_paths, eval_paths = split_holdout(calibration_paths,
+                                                      args.holdout)
+        eval_set = (f'held-out images of {args.calibration_dir} not used '
+                    f'for the calibration')
+    logger.info(f'Calibrating on {len(calibration_paths)} images of '
+                f'{args.calibration_dir}')
+    calibration_batches = load_images(config, calibration_paths,
+                                      args.batch_size)
+    quantized = quantize(model, config, calibration_batches)
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    quantized.save(output_path.as_posix())
+    logger.info(f'Saved the quantized {config.mode} model to {output_path}')
+
+    eval_batches = load_images(config, eval_paths, args.batch_size)
+    compare(model, quantized, config, eval_batches, eval_set)
@@ -0,0 +1,218 @@
+"""Writers of the per-face gaze estimation results.
+
+Each detected face of each frame becomes a record of the flat scalar
+columns in ``COLUMNS``. The angles are in degrees, in the same convention
+as the values logged by the demo, and the head position is in meters. The
+records are buffered and written in bulk, in one of these formats:
+
+- ``.parquet``: needs pyarrow, and falls back to JSONL without it.
+- ``.npz``: compressed NumPy arrays, one per column, written on close.
+- ``.jsonl``: one JSON object per line.
+"""
+import abc
+import importlib.util
+import json
+import logging
+import pathlib
+from typing import Dict, List
+
+import numpy as np
+
+from .common import Face
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = {
+    'frame_index': np.int64,
+    'timestamp': np.float64,  # Seconds
+    'face_id': np.int64,  # -1 unless the face is tracked
+    'bbox_x0': np.float32,
+    'bbox_y0': np.float32,
+    'bbox_x1': np.float32,
+    'bbox_y1': np.float32,
+    'head_pitch': np.float32,
+    'head_yaw': np.float32,
+    'head_roll': np.float32,
+    'head_x': np.float32,
+    'head_y': np.float32,
+    'head_z': np.float32,
+    'gaze_pitch': np.float32,
+    'gaze_yaw': np.float32,
+}
+
+RESULTS_FORMATS = ['parquet', 'npz', 'jsonl']
+
+
+def _compute_gaze_vector(face: Face) -> np.ndarray:
+    if face.gaze_vector is not None:
+        return face.gaze_vector
+    # MPIIGaze estimates the gaze of each eye.
+    vector = face.reye.gaze_vector + face.leye.gaze_vector
+    return vector / np.linalg.norm(vector)
+
+
+class ResultsWriter(abc.ABC):
+    def __init__(self, path: pathlib.Path, buffer_size: int = 4096):
+        self.path = path
+        self._buffer_size = buffer_size
+        self._buffer: Dict[str, List] = {name: [] for name in COLUMNS}
+        self._n_buffered = 0
+
+    def __enter__(self) -> 'ResultsWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, frame_index: int, timestamp: float,
+            faces: List[Face]) -> None:
+        for face in faces:
+            head_angles = face.change_coordinate_system(
+                face.head_pose_rot.as_euler('XYZ', degrees=True))
+            gaze_angles = np.rad2deg(
+                face.vector_to_angle(_compute_gaze_vector(face)))
+            face_id = -1 if face.face_id is None else face.face_id
+            # In the order of COLUMNS
+            row = (frame_index, timestamp, face_id, *face.bbox.ravel(),
+                   *head_angles, *face.head_position, *gaze_angles)
+            for values, value in zip(self._buffer.values(), row):
+                values.append(value)
+        self._n_buffered += len(faces)
+        if self._n_buffered >= self._buffer_size:
+            self.flush()
+
+    def add_columns(self, columns: Dict[str, np.ndarray]) -> None:
+        """Write records already gathered as columns, e.g. read from a file."""
+        self.flush()
+        self._write(columns)
+
+    def flush(self) -> None:
+        if self._n_buffered == 0:
+            return
+        columns = {
+            name: np.asarray(values, dtype=COLUMNS[name])
+            for name, values in self._buffer.items()
+        }
+        self._write(columns)
+        for values in self._buffer.values():
+            values.clear()
+        self._n_buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+
+    @abc.abstractmethod
+    def _write(self, columns: Dict[str, np.ndarray]) -> None:
+        """Write the records of the columns to the file."""
+
+
+class ParquetResultsWriter(ResultsWriter):
+    """Writes a row group per flush."""
+    def __init__(self, path: pathlib.Path, buffer_size: int = 4096):
+        super().__init__(path, buffer_size)
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype))
+                                       for name, dtype in COLUMNS.items()])
+        self._writer = pyarrow.parquet.ParquetWriter(path.as_posix(),
+                                                     self._schema)
+
+    def close(self) -> None:
+        super().close()
+        self._writer.close()
+
+    def _write(self, columns: Dict[str, np.ndarray]) -> None:
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+
+
+class NpzResultsWriter(ResultsWriter):
+    """Keeps the flushed chunks and saves them all on close."""
+    def __init__(self, path: pathlib.Path, buffer_size: int = 4096):
+        super().__init__(path, buffer_size)
+        self._chunks: List[Dict[str, np.ndarray]] = []
+
+    def close(self) -> None:
+        super().close()
+        np.savez_compressed(
+            self.path, **{
+                name: np.concatenate([chunk[name] for chunk in self._chunks] +
+                                     [np.empty(0, dtype=dtype)])
+                for name, dtype in COLUMNS.items()
+            })
+
+    def _write(self, columns: Dict[str, np.ndarray]) -> None:
+        self._chunks.append(columns)
+
+
+class JsonlResultsWriter(ResultsWriter):
+    def __init__(self, path: pathlib.Path, buffer_size: int = 4096):
+        super().__init__(path, buffer_size)
+        self._file = open(path, 'w')
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+    def _write(self, columns: Dict[str, np.ndarray]) -> None:
+        names = list(columns)
+        rows = zip(*(columns[name].tolist() for name in names))
+        self._file.write(''.join(
+            json.dumps(dict(zip(names, row))) + '\n' for row in rows))
+
+
+def resolve_results_path(path: pathlib.Path) -> pathlib.Path:
+    """Replace the Parquet suffix with JSONL if pyarrow is not installed."""
+    if path.suffix == '.parquet' and importlib.util.find_spec(
+            'pyarrow') is None:
+        logger.warning(f'pyarrow is not installed, so the results are '
+                       f'written to JSONL instead of {path}.')
+        return path.with_suffix('.jsonl')
+    return path
+
+
+def create_results_writer(path: str, buffer_size: int = 4096) -> ResultsWriter:
+    """Create the writer for the format given by the suffix of ``path``.
+
+    The suffix is replaced as in ``resolve_results_path``.
+    """
+    path = resolve_results_path(pathlib.Path(path))
+    path.parent.mkdir(exist_ok=True, parents=True)
+    if path.suffix == '.parquet':
+        return ParquetResultsWriter(path, buffer_size)
+    elif path.suffix == '.npz':
+        return NpzResultsWriter(path, buffer_size)
+    elif path.suffix == '.jsonl':
+        return JsonlResultsWriter(path, buffer_size)
+    else:
+        raise ValueError(f'Unknown results format: {path.suffix}')
+
+
+def read_results(path: str) -> Dict[str, np.ndarray]:
+    """Read the results written by a ResultsWriter as columns."""
+    path = pathlib.Path(path)
+    if path.suffix == '.parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path.as_posix())
+        return {name: table[name].to_numpy() for name in COLUMNS}
+    elif path.suffix == '.npz':
+        with np.load(path) as data:
+            return {name: data[name] for name in COLUMNS}
+    elif path.suffix == '.jsonl':
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        return {
+            name: np.array([record[name] for record in records], dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+    else:
+        raise ValueError(f'Unknown results format: {path.suffix}')
+
+
+def merge_results(paths: List[str], output_path: str) -> None:
+    """Concatenate the results files and delete them."""
+    with create_results_writer(output_path) as writer:
+        for path in paths:
+            writer.add_columns(read_results(path))
+            pathlib.Path(path).unlink()
@@ -0,0 +1,121 @@
+"""Latency of the stages of the gaze estimation pipeline.
+
+``StageTimer`` keeps the durations of the last frames of each stage, from
+which it computes rolling percentiles. Within ``frame``, the durations of
+a stage measured several times in the same frame, e.g. once per face, are
+summed and recorded once for the frame, together with the total duration
+of the frame. Outside of it, each measurement is recorded as it is.
+"""
+import collections
+import contextlib
+import logging
+import time
+from typing import Deque, Dict, Iterator, Optional
+
+import numpy as np
+
+# The stages in the order of the pipeline. The summaries list them first.
+STAGES = [
+    'decode',
+    'undistort',
+    'detection',
+    'head_pose',
+    'normalization',
+    'preprocessing',
+    'inference',
+    'drawing',
+    'total',
+]
+
+PERCENTILES = [50, 95, 99]
+
+
+class StageTimer:
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._durations: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = collections.Counter()
+        self._frame: Optional[Dict[str, float]] = None
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if self._frame is not None:
+                self._frame[stage] = self._frame.get(stage, 0.) + duration
+            else:
+                self.record(stage, duration)
+
+    @contextlib.contextmanager
+    def frame(self) -> Iterator[Dict[str, float]]:
+        """Gather the durations of a frame in the yielded dict.
+
+        The durations are in seconds, and ``total`` is added on exit.
+        """
+        durations = {}
+        self._frame = durations
+        start = time.perf_counter()
+        try:
+            yield durations
+        finally:
+            durations['total'] = time.perf_counter() - start
+            self._frame = None
+            self.add_frame(durations)
+
+    def add_frame(self, durations: Dict[str, float]) -> None:
+        """Record the durations in seconds of a frame measured elsewhere."""
+        for stage, duration in durations.items():
+            self.record(stage, duration)
+
+    def record(self, stage: str, duration: float) -> None:
+        values = self._durations.get(stage)
+        if values is None:
+            values = collections.deque(maxlen=self.window)
+            self._durations[stage] = values
+        values.append(duration)
+        self._counts[stage] += 1
+
+    def reset(self) -> None:
+        self._durations.clear()
+        self._counts.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """The count and the mean and percentiles in milliseconds.
+
+        The mean and the percentiles are over the last ``window``
+        durations of each stage, and the count is over all of them.
+        """
+        stages = sorted(self._durations,
+                        key=lambda stage: STAGES.index(stage)
+                        if stage in STAGES else len(STAGES))
+        summary = {}
+        for stage in stages:
+            values = np.array(self._durations[stage]) * 1000
+            summary[stage] = {
+                'count': self._counts[stage],
+                'mean_ms': float(values.mean()),
+                **{
+                    f'p{q}_ms': float(value)
+                    for q, value in zip(PERCENTILES,
+                                        np.percentile(values, PERCENTILES))
+                },
+            }
+        return summary
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        summary = self.summary()
+        if not summary:
+            return
+        lines = [
+            f'[latency] {"stage":<14} {"count":>7} {"mean ms":>8} ' +
+            ' '.join(f'{f"p{q} ms":>8}' for q in PERCENTILES)
+        ]
+        for stage, stats in summary.items():
+            lines.append(f'[latency] {stage:<14} {stats["count"]:7d} '
+                         f'{stats["mean_ms"]:8.3f} ' +
+                         ' '.join(f'{stats[f"p{q}_ms"]:8.3f}'
+                                  for q in PERCENTILES))
+        logger.info('\n'.join(lines))
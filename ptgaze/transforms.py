@@ -1,6 +1,8 @@
-from typing import Any
+from typing import Any, List, Optional, Sequence, Tuple
 
 import cv2
+import numpy as np
+import torch
 import torchvision.transforms as T
 from omegaconf import DictConfig
 
@@ -37,3 +39,88 @@ def _create_ethxgaze_transform(config: DictConfig) -> Any:
                                                      0.225]),  # RGB
     ])
     return transform
+
+
+class BatchTransform:
+    """Convert normalized images into a model input batch in one step.
+
+    This is a fused version of the transforms above. Each image is
+    written directly into a preallocated float32 NCHW tensor, with the
+    channel reordering and the mean/std normalization applied on the
+    way, instead of going through a separate array or tensor for each
+    step. The tensor is in pinned memory when the model runs on CUDA,
+    so the copy to the device is asynchronous.
+
+    The images are expected to have the model input size already, which
+    is the case when the normalization warps directly to that size. Other
+    sizes are resized first.
+    """
+    def __init__(self, size: Tuple[int, int], mean: Sequence[float],
+                 std: Sequence[float], channels: Optional[Sequence[int]],
+                 device: torch.device):
+        self.size = size
+        self.device = device
+        # The source channel of each output channel, None for grayscale
+        self._channels = channels
+        # (x / 255 - mean) / std == x * scale - offset
+        std = np.asarray(std, dtype=np.float32)
+        self._scales = 1 / (255 * std)
+        self._offsets = np.asarray(mean, dtype=np.float32) / std
+
+        self._buffer: Optional[torch.Tensor] = None
+        self._copy_done: Optional[torch.cuda.Event] = None
+
+    def __call__(self, images: List[np.ndarray]) -> torch.Tensor:
+        batch = self._get_buffer(len(images))
+        array = batch.numpy()
+        width, height = self.size
+        for image, out in zip(images, array):
+            if image.shape[:2] != (height, width):
+                image = cv2.resize(image, self.size)
+            if self._channels is None:
+                image = image[:, :, np.newaxis]
+                channels = [0]
+            else:
+                channels = self._channels
+            for index, channel in enumerate(channels):
+                np.multiply(image[:, :, channel],
+                            self._scales[index],
+                            out=out[index])
+                out[index] -= self._offsets[index]
+
+        if self.device.type != 'cuda':
+            return batch
+        batch = batch.to(self.device, non_blocking=True)
+        self._copy_done = torch.cuda.Event()
+        self._copy_done.record()
+        return batch
+
+    def _get_buffer(self, batch_size: int) -> torch.Tensor:
+        # The previous batch may still be copied to the device.
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+            self._copy_done = None
+        if self._buffer is None or len(self._buffer) < batch_size:
+            width, height = self.size
+            n_channels = 1 if self._channels is None else len(self._channels)
+            self._buffer = torch.empty((batch_size, n_channels, height, width),
+                                       dtype=torch.float32,
+                                       pin_memory=self.device.type == 'cuda')
+        return self._buffer[:batch_size]
+
+
+def create_batch_transform(config: DictConfig,
+                           size: Tuple[int, int]) -> BatchTransform:
+    device = torch.device(config.device)
+    if config.mode == 'MPIIGaze':
+        return BatchTransform(size, [0.], [1.], None, device)
+    elif config.mode == 'MPIIFaceGaze':
+        # BGR
+        return BatchTransform(size, [0.406, 0.456, 0.485],
+                              [0.225, 0.224, 0.229], [0, 1, 2], device)
+    elif config.mode == 'ETH-XGaze':
+        # BGR -> RGB
+        return BatchTransform(size, [0.485, 0.456, 0.406],
+                              [0.229, 0.224, 0.225], [2, 1, 0], device)
+    else:
+        raise ValueError
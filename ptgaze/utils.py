@@ -1,20 +1,59 @@
 import bz2
 import logging
 import operator
+import os
 import pathlib
 import tempfile
 
 import cv2
 import torch.hub
 import yaml
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 
+from .common.camera import Camera
 from .common.face_model import FaceModel
 from .common.face_model_68 import FaceModel68
 from .common.face_model_mediapipe import FaceModelMediaPipe
 
 logger = logging.getLogger(__name__)
 
+MODE_CONFIGS = {
+    'mpiigaze': 'mpiigaze.yaml',
+    'mpiifacegaze': 'mpiifacegaze.yaml',
+    'eth-xgaze': 'eth-xgaze.yaml',
+}
+
+# The file suffixes of the models exported for each inference backend
+EXPORTED_MODEL_SUFFIXES = {
+    'torchscript': '.torchscript.pt',
+    'torch_export': '.pt2',
+    'onnxruntime': '.onnx',
+}
+
+
+def load_packaged_config(mode: str) -> DictConfig:
+    """Load the packaged config of the mode given on the command line."""
+    package_root = pathlib.Path(__file__).parent.resolve()
+    if mode not in MODE_CONFIGS:
+        raise ValueError
+    config = OmegaConf.load(package_root / 'data/configs' / MODE_CONFIGS[mode])
+    config.PACKAGE_ROOT = package_root.as_posix()
+    return config
+
+
+def load_config_file(path: str) -> DictConfig:
+    """Load the config file given with ``--config``.
+
+    The file is merged over the packaged config of its mode, so the config
+    files written for older versions get the defaults of the keys added
+    since then.
+    """
+    config = OmegaConf.load(path)
+    if 'mode' not in config:
+        raise ValueError(f'{path} does not specify the mode.')
+    defaults = load_packaged_config(str(config.mode).lower())
+    return OmegaConf.merge(defaults, config)
+
 
 def get_3d_face_model(config: DictConfig) -> FaceModel:
     if config.face_detector.mode == 'mediapipe':
@@ -95,6 +134,32 @@ def download_ethxgaze_model() -> pathlib.Path:
     return output_path
 
 
+def download_gaze_model(config: DictConfig) -> pathlib.Path:
+    if config.mode == 'MPIIGaze':
+        return download_mpiigaze_model()
+    elif config.mode == 'MPIIFaceGaze':
+        return download_mpiifacegaze_model()
+    elif config.mode == 'ETH-XGaze':
+        return download_ethxgaze_model()
+    else:
+        raise ValueError
+
+
+def get_exported_model_path(config: DictConfig) -> pathlib.Path:
+    """Path of the model exported for the inference backend.
+
+    Unless ``config.gaze_estimator.exported_model`` is set, this is the
+    checkpoint path with the suffix of the backend, prefixed with
+    ``.int8`` for the quantized models.
+    """
+    if config.gaze_estimator.exported_model:
+        return pathlib.Path(config.gaze_estimator.exported_model)
+    suffix = EXPORTED_MODEL_SUFFIXES[config.gaze_estimator.inference_backend]
+    if config.gaze_estimator.quantized:
+        suffix = '.int8' + suffix
+    return pathlib.Path(config.gaze_estimator.checkpoint).with_suffix(suffix)
+
+
 def generate_dummy_camera_params(config: DictConfig) -> None:
     logger.debug('Called _generate_dummy_camera_params()')
     if config.demo.image_path:
@@ -114,15 +179,24 @@ def generate_dummy_camera_params(config: DictConfig) -> None:
         raise ValueError
     logger.debug(f'Frame size is ({w}, {h})')
     logger.debug(f'Close video {config.demo.video_path}')
+    path = write_dummy_camera_params(w, h)
+    config.gaze_estimator.camera_params = path
+    logger.debug(f'Update config.gaze_estimator.camera_params to {path}')
+
+
+def write_dummy_camera_params(width: int, height: int) -> str:
+    """Write the params of a camera without distortion whose focal length is
+    the image width to a temporary file, and return its path."""
     out_file = tempfile.NamedTemporaryFile(suffix='.yaml', delete=False)
     logger.debug(f'Create a dummy camera param file {out_file.name}')
     dic = {
-        'image_width': w,
-        'image_height': h,
+        'image_width': width,
+        'image_height': height,
         'camera_matrix': {
             'rows': 3,
             'cols': 3,
-            'data': [w, 0., w // 2, 0., w, h // 2, 0., 0., 1.]
+            'data':
+            [width, 0., width // 2, 0., width, height // 2, 0., 0., 1.]
         },
         'distortion_coefficients': {
             'rows': 1,
@@ -132,9 +206,17 @@ def generate_dummy_camera_params(config: DictConfig) -> None:
     }
     with open(out_file.name, 'w') as f:
         yaml.safe_dump(dic, f)
-    config.gaze_estimator.camera_params = out_file.name
-    logger.debug(
-        f'Update config.gaze_estimator.camera_params to {out_file.name}')
+    return out_file.name
+
+
+def create_dummy_camera(width: int, height: int) -> Camera:
+    """The camera of ``write_dummy_camera_params`` for frames of the given
+    size, when the calibration of the camera is unknown."""
+    path = write_dummy_camera_params(width, height)
+    try:
+        return Camera(path)
+    finally:
+        os.remove(path)
 
 
 def _expanduser(path: str) -> str:
@@ -149,6 +231,8 @@ def expanduser_all(config: DictConfig) -> None:
             config.face_detector.dlib_model_path)
     config.gaze_estimator.checkpoint = _expanduser(
         config.gaze_estimator.checkpoint)
+    config.gaze_estimator.exported_model = _expanduser(
+        config.gaze_estimator.exported_model)
     config.gaze_estimator.camera_params = _expanduser(
         config.gaze_estimator.camera_params)
     config.gaze_estimator.normalized_camera_params = _expanduser(
@@ -159,6 +243,8 @@ def expanduser_all(config: DictConfig) -> None:
         config.demo.video_path = _expanduser(config.demo.video_path)
     if hasattr(config.demo, 'output_dir'):
         config.demo.output_dir = _expanduser(config.demo.output_dir)
+    if hasattr(config.demo, 'results_path'):
+        config.demo.results_path = _expanduser(config.demo.results_path)
 
 
 def _check_path(config: DictConfig, key: str) -> None:
@@ -177,6 +263,6 @@ def check_path_all(config: DictConfig) -> None:
     _check_path(config, 'gaze_estimator.camera_params')
     _check_path(config, 'gaze_estimator.normalized_camera_params')
     if config.demo.image_path:
-        _check_path(config, 'mock demo.image_path')
+        _check_path(config, 'demo.image_path')
     if config.demo.video_path:
-        _check_path(config, 'mock demo.video_path')
+        _check_path(config, 'demo.video_path')
@@ -0,0 +1,99 @@
+"""Encoding the overlay videos on a background thread.
+
+``AsyncVideoWriter`` puts the frames in a bounded queue, from which a
+thread writes them with cv2.VideoWriter, so the encoding doesn't stall the
+processing loop. When the queue is full, ``write`` waits, and the queue
+depth and the time spent waiting tell whether the encoding is the
+bottleneck.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FOURCCS = {
+    'mp4': 'H264',
+    'avi': 'PIM1',
+}
+
+# Marks the end of the frames in the queue
+_END = None
+
+
+class AsyncVideoWriter:
+    def __init__(self, writer: cv2.VideoWriter, queue_size: int = 8):
+        self._writer = writer
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._write_frames,
+                                        name='video_writer',
+                                        daemon=True)
+        self._thread.start()
+
+        self.n_written = 0
+        # The number of the frames which found the queue full, and the total
+        # time spent waiting for them
+        self.n_blocked = 0
+        self.blocked_time = 0.
+        # The queue depths seen by write, for the mean and the maximum
+        self.total_queue_depth = 0
+        self.max_queue_depth = 0
+        # The time spent encoding in the writer thread
+        self.encode_time = 0.
+
+    def write(self, image: np.ndarray) -> None:
+        """Queue a frame. The frame must not be modified afterwards."""
+        if self._error is not None:
+            raise RuntimeError('The video writer failed.') from self._error
+        depth = self._queue.qsize()
+        self.total_queue_depth += depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        try:
+            self._queue.put_nowait(image)
+        except queue.Full:
+            self.n_blocked += 1
+            start = time.perf_counter()
+            self._queue.put(image)
+            self.blocked_time += time.perf_counter() - start
+        self.n_written += 1
+
+    def release(self) -> None:
+        """Write the queued frames and close the video."""
+        self._queue.put(_END)
+        self._thread.join()
+        self._writer.release()
+        if self._error is not None:
+            raise RuntimeError('The video writer failed.') from self._error
+
+    def log_stats(self) -> None:
+        if self.n_written == 0:
+            return
+        logger.info(
+            f'[video writer] frames: {self.n_written}, queue depth: '
+            f'{self.total_queue_depth / self.n_written:.2f} mean, '
+            f'{self.max_queue_depth} max of {self.queue_size}, '
+            f'blocked: {self.n_blocked} frames ({self.blocked_time:.2f} s), '
+            f'{self.encode_time / self.n_written * 1000:.3f} ms/frame')
+
+    def _write_frames(self) -> None:
+        while True:
+            image = self._queue.get()
+            if image is _END:
+                return
+            # After a failure, the frames are only taken from the queue, so
+            # that write doesn't block.
+            if self._error is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                self._writer.write(image)
+            except Exception as e:
+                self._error = e
+            self.encode_time += time.perf_counter() - start
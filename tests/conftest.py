@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+# The backend modules import each other as top-level modules, like when the
+# backend is started from its directory.
+sys.path.insert(0, (pathlib.Path(__file__).parents[1] / 'backend').as_posix())
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+
+from frame_executor import ExecutorSaturated, FrameExecutor
+
+
+def _fail():
+    raise RuntimeError('frame failed')
+
+
+def test_rejects_at_max_workers_plus_queue_depth():
+    async def run():
+        executor = FrameExecutor(max_workers=2, max_queue_depth=1)
+        release = threading.Event()
+        try:
+            tasks = [
+                asyncio.create_task(executor.run(release.wait))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0)
+            assert executor.in_flight == 3
+            assert executor.queue_depth == 1
+            assert executor.saturated
+            with pytest.raises(ExecutorSaturated):
+                await executor.run(sum, [1, 2])
+        finally:
+            release.set()
+        assert await asyncio.gather(*tasks) == [True] * 3
+        assert executor.in_flight == 0
+        assert await executor.run(sum, [1, 2]) == 3
+        executor.shutdown()
+
+    asyncio.run(run())
+
+
+def test_releases_in_flight_on_failure():
+    async def run():
+        executor = FrameExecutor(max_workers=1, max_queue_depth=0)
+        with pytest.raises(RuntimeError, match='frame failed'):
+            await executor.run(_fail)
+        assert executor.in_flight == 0
+        assert await executor.run(sum, [1, 2]) == 3
+        executor.shutdown()
+
+    asyncio.run(run())
+
+
+def test_counts_cancelled_frame_until_worker_finishes():
+    async def run():
+        executor = FrameExecutor(max_workers=1, max_queue_depth=0)
+        release = threading.Event()
+        task = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        # The worker still runs the frame of the disconnected client
+        assert executor.in_flight == 1
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(sum, [1, 2])
+        release.set()
+        await asyncio.sleep(0.05)
+        assert executor.in_flight == 0
+        executor.shutdown()
+
+    asyncio.run(run())
+
+
+def test_replaces_broken_executor():
+    calls = []
+
+    def initializer():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError('model failed to load')
+
+    async def run():
+        executor = FrameExecutor(max_workers=1,
+                                 max_queue_depth=0,
+                                 initializer=initializer)
+        with pytest.raises(Exception):
+            await executor.run(sum, [1, 2])
+        assert await executor.run(sum, [1, 2]) == 3
+        assert executor.in_flight == 0
+        executor.shutdown()
+
+    asyncio.run(run())
+
+
+def test_monitor_student_returns_429_when_saturated():
+    pytest.importorskip('fastapi')
+    from fastapi.testclient import TestClient
+
+    import quizsecure_backend
+
+    executor = FrameExecutor(max_workers=1, max_queue_depth=1)
+    # As if a frame ran on the worker and another one waited for it
+    executor._in_flight = 2
+    quizsecure_backend.frame_executor = executor
+    try:
+        # Without the context manager, the startup hook doesn't run
+        client = TestClient(quizsecure_backend.app)
+        response = client.post('/monitor-student',
+                               params={'user_id': 'student'},
+                               files={'frame': ('frame.jpg', b'data')})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        quizsecure_backend.frame_executor = None
+        executor.shutdown()
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+
+from inference_scheduler import InferenceScheduler
+
+
+class _Face:
+    gaze_vector = None
+
+
+class _GazeEstimator:
+    """Records the size of each forward pass, optionally blocking in it."""
+    def __init__(self):
+        self.batch_sizes = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def predict_gaze(self, faces):
+        self.release.wait()
+        self.batch_sizes.append(len(faces))
+        for face in faces:
+            face.gaze_vector = len(self.batch_sizes)
+
+
+def _faces(n):
+    return [_Face() for _ in range(n)]
+
+
+def test_batches_concurrent_requests():
+    async def run():
+        estimator = _GazeEstimator()
+        batch_sizes = []
+        scheduler = InferenceScheduler(estimator,
+                                       max_batch_size=8,
+                                       max_wait_ms=50,
+                                       on_batch=batch_sizes.append)
+        await scheduler.start()
+        requests = [_faces(2) for _ in range(3)]
+        results = await asyncio.gather(
+            *[scheduler.predict(faces) for faces in requests])
+        await scheduler.stop()
+
+        assert results == requests
+        assert estimator.batch_sizes == [6]
+        assert batch_sizes == [6]
+        assert all(face.gaze_vector == 1 for faces in requests
+                   for face in faces)
+        assert (scheduler.total_batches, scheduler.total_faces) == (1, 6)
+
+    asyncio.run(run())
+
+
+def test_carries_request_that_does_not_fit_and_splits_large_ones():
+    async def run():
+        estimator = _GazeEstimator()
+        scheduler = InferenceScheduler(estimator,
+                                       max_batch_size=4,
+                                       max_wait_ms=50)
+        await scheduler.start()
+        await asyncio.gather(scheduler.predict(_faces(3)),
+                             scheduler.predict(_faces(3)))
+        await scheduler.predict(_faces(10))
+        await scheduler.stop()
+        assert estimator.batch_sizes == [3, 3, 4, 4, 2]
+
+    asyncio.run(run())
+
+
+def test_raises_queue_full_beyond_max_queue_depth():
+    async def run():
+        estimator = _GazeEstimator()
+        estimator.release.clear()
+        scheduler = InferenceScheduler(estimator,
+                                       max_batch_size=1,
+                                       max_wait_ms=0,
+                                       max_queue_depth=1)
+        await scheduler.start()
+        # The first request blocks in the forward pass, the second waits
+        # in the queue and the third doesn't fit anymore
+        first = asyncio.create_task(scheduler.predict(_faces(1)))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(scheduler.predict(_faces(1)))
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 1
+        with pytest.raises(asyncio.QueueFull):
+            await scheduler.predict(_faces(1))
+
+        estimator.release.set()
+        await asyncio.gather(first, second)
+        assert scheduler.queue_depth == 0
+        await scheduler.stop()
+        assert estimator.batch_sizes == [1, 1]
+
+    asyncio.run(run())
+
+
+def test_restarts_after_stop():
+    async def run():
+        estimator = _GazeEstimator()
+        scheduler = InferenceScheduler(estimator, max_wait_ms=0)
+        for _ in range(2):
+            await scheduler.start()
+            await scheduler.predict(_faces(1))
+            await scheduler.stop()
+        assert estimator.batch_sizes == [1, 1]
+        with pytest.raises(RuntimeError):
+            await scheduler.predict(_faces(1))
+
+    asyncio.run(run())
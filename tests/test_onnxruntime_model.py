@@ -0,0 +1,36 @@
+import pathlib
+
+import pytest
+import torch
+from numpy.testing import assert_allclose
+
+from ptgaze.export import create_example_inputs, export_onnx
+from ptgaze.models import OnnxRuntimeModel, create_model
+from ptgaze.utils import load_packaged_config
+
+pytest.importorskip('onnxruntime')
+
+
+@pytest.mark.parametrize('mode', ['mpiigaze', 'mpiifacegaze', 'eth-xgaze'])
+@torch.no_grad()
+def test_onnxruntime_matches_pytorch(mode: str, tmp_path: pathlib.Path):
+    config = load_packaged_config(mode)
+    config.device = 'cpu'
+    if 'backbone' in config.model:
+        # Random weights are enough to compare the backends
+        config.model.backbone.pretrained = None
+    torch.manual_seed(0)
+    model = create_model(config)
+    model.eval()
+
+    path = tmp_path / 'model.onnx'
+    export_onnx(config, path, model)
+    onnx_model = OnnxRuntimeModel(path.as_posix(), torch.device('cpu'))
+
+    for batch_size in [1, 3]:
+        inputs = create_example_inputs(config, batch_size)
+        expected = model(*inputs)
+        actual = onnx_model(*inputs)
+        assert actual.shape == expected.shape
+        assert_allclose(actual.numpy(), expected.numpy(), rtol=1e-4,
+                        atol=1e-5)